@@ -0,0 +1,46 @@
+"""
+Compare two benchmark result files side by side.
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import sys
+import json
+
+FIELDS = ["requests_per_second", "p50_ms", "p95_ms", "p99_ms", "error_rate", "peak_rss_mb"]
+
+
+def _load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report, {(r["scenario"], r["concurrency"]): r for r in report["results"]}
+
+
+def _change(old, new):
+    if old in (None, 0) or new is None:
+        return ""
+    return f"{(new - old) / old:+.1%}"
+
+
+def main(old_path: str, new_path: str):
+    old_report, old = _load(old_path)
+    new_report, new = _load(new_path)
+    print(f"old: {old_path} ({old_report.get('commit')}, {old_report['profile_name']})")
+    print(f"new: {new_path} ({new_report.get('commit')}, {new_report['profile_name']})")
+    if old_report["profile_name"] != new_report["profile_name"]:
+        print("warning: runs used different upstream profiles")
+    if old_report.get("memory_scope") != new_report.get("memory_scope"):
+        print("warning: peak_rss_mb measured different processes; memory is not comparable")
+    if old_report.get("upstream_limits") != new_report.get("upstream_limits"):
+        print("warning: runs used different upstream limits; throughput is not directly comparable")
+
+    for key in sorted(set(old) & set(new)):
+        print(f"\n{key[0]} @ concurrency {key[1]}")
+        for field in FIELDS:
+            a, b = old[key].get(field), new[key].get(field)
+            print(f"  {field:<22}{str(a):>12}{str(b):>12}{_change(a, b):>10}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m benchmarks.compare OLD.json NEW.json")
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,272 @@
+"""
+Local stand-ins for the upstream services, so benchmarks spend no API quota.
+
+One FastAPI app fakes:
+  - Gemini generateContent (text and vision, REST transport)
+  - Gemini embedContent / batchEmbedContents (embedding-001, 768 dims)
+  - OpenPetFoodFacts /api/v0/search
+
+Each service has its own latency, error and rate-limit profile. Point the
+backend at the fakes with GEMINI_API_ENDPOINT=http://host:port and
+OPENPETFOODFACTS_URL=http://host:port/api/v0.
+"""
+import os
+import sys
+import json
+import asyncio
+import hashlib
+import random
+import threading
+import subprocess
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+EMBEDDING_DIMENSION = 768
+
+
+@dataclass
+class ServiceProfile:
+    """Behaviour of one fake upstream."""
+    latency_ms: float = 50.0
+    jitter_ms: float = 10.0
+    error_rate: float = 0.0        # fraction of requests answered with HTTP 500
+    rate_limit_rps: float = 0.0    # 0 disables; above this rate requests get HTTP 429
+    burst: int = 10
+
+    def delay(self) -> float:
+        return max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+
+
+@dataclass
+class FakeProfile:
+    text: ServiceProfile = field(default_factory=ServiceProfile)
+    vision: ServiceProfile = field(default_factory=ServiceProfile)
+    embed: ServiceProfile = field(default_factory=ServiceProfile)
+    food: ServiceProfile = field(default_factory=ServiceProfile)
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "FakeProfile":
+        return cls(**{service: ServiceProfile(**settings) for service, settings in data.items()})
+
+
+PROFILES: Dict[str, FakeProfile] = {
+    "instant": FakeProfile(*(ServiceProfile(latency_ms=0, jitter_ms=0) for _ in range(4))),
+    "realistic": FakeProfile(
+        text=ServiceProfile(latency_ms=1200, jitter_ms=400),
+        vision=ServiceProfile(latency_ms=4000, jitter_ms=1200),
+        embed=ServiceProfile(latency_ms=120, jitter_ms=40),
+        food=ServiceProfile(latency_ms=600, jitter_ms=300),
+    ),
+    "degraded": FakeProfile(
+        text=ServiceProfile(latency_ms=2500, jitter_ms=1500, error_rate=0.05, rate_limit_rps=5),
+        vision=ServiceProfile(latency_ms=8000, jitter_ms=3000, error_rate=0.05, rate_limit_rps=1),
+        embed=ServiceProfile(latency_ms=300, jitter_ms=200, error_rate=0.02, rate_limit_rps=20),
+        food=ServiceProfile(latency_ms=2000, jitter_ms=1500, error_rate=0.1),
+    ),
+}
+
+
+class _Bucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def _error(status: int, message: str) -> JSONResponse:
+    status_name = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL"}[status]
+    return JSONResponse(status_code=status,
+                        content={"error": {"code": status, "message": message, "status": status_name}})
+
+
+def _fake_embedding(text: str):
+    """Deterministic unit-ish vector so identical text always embeds identically."""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    return [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIMENSION)]
+
+
+def _text_of(content: Dict) -> str:
+    return " ".join(part.get("text", "") for part in content.get("parts", []))
+
+
+def create_fake_app(profile: FakeProfile) -> FastAPI:
+    app = FastAPI(title="PetoAI upstream fakes")
+    buckets = {}
+    for name in ("text", "vision", "embed", "food"):
+        settings: ServiceProfile = getattr(profile, name)
+        if settings.rate_limit_rps:
+            buckets[name] = _Bucket(settings.rate_limit_rps, settings.burst)
+    app.state.calls = {"text": 0, "vision": 0, "embed": 0, "food": 0}
+
+    async def gate(service: str) -> Optional[JSONResponse]:
+        """Apply the service's rate limit, latency and error profile."""
+        app.state.calls[service] += 1
+        settings: ServiceProfile = getattr(profile, service)
+        if service in buckets and not buckets[service].take():
+            return _error(429, "Resource has been exhausted (e.g. check quota).")
+        await asyncio.sleep(settings.delay())
+        if random.random() < settings.error_rate:
+            return _error(500, "An internal error has occurred.")
+        return None
+
+    @app.post("/v1beta/models/{model_action}")
+    async def models(model_action: str, request: Request):
+        model, _, action = model_action.partition(":")
+        body = await request.json()
+
+        if action in ("embedContent", "batchEmbedContents"):
+            failure = await gate("embed")
+            if failure:
+                return failure
+            if action == "embedContent":
+                return {"embedding": {"values": _fake_embedding(_text_of(body.get("content", {})))}}
+            return {"embeddings": [{"values": _fake_embedding(_text_of(r.get("content", {})))}
+                                   for r in body.get("requests", [])]}
+
+        if action != "generateContent":
+            return _error(500, f"Unsupported action {action}")
+
+        contents = body.get("contents", [])
+        has_image = any("inlineData" in part or "inline_data" in part
+                        for content in contents for part in content.get("parts", []))
+        service = "vision" if has_image else "text"
+        failure = await gate(service)
+        if failure:
+            return failure
+
+        prompt_chars = sum(len(_text_of(c)) for c in contents)
+        text = (f"## Fake {service} answer from {model}\n"
+                f"- This response was generated locally for benchmarking.\n"
+                f"- Prompt length: {prompt_chars} characters.")
+        return {
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            "usageMetadata": {
+                "promptTokenCount": prompt_chars // 4,
+                "candidatesTokenCount": len(text) // 4,
+                "totalTokenCount": prompt_chars // 4 + len(text) // 4,
+            },
+        }
+
+    @app.get("/_fake/calls")
+    async def calls():
+        """Requests received per service, read by benchmarks/run.py."""
+        return app.state.calls
+
+    @app.get("/api/v0/search")
+    async def search(request: Request):
+        failure = await gate("food")
+        if failure:
+            return failure
+        return {"products": [
+            {
+                "product_name": f"{food_type} Formula {i}",
+                "brands": "BenchBrand",
+                "nutrition_grades": "b",
+                "ingredients_text": "chicken, rice, vitamins",
+                "nutriments": {"proteins_100g": 26, "fat_100g": 14},
+            }
+            for i, food_type in enumerate(["Dry Food", "Wet Food", "Raw Diet", "Home Cooked", "Grain-Free"])
+        ]}
+
+    return app
+
+
+class FakeUpstreams:
+    """
+    Runs the fake app in a child process: `with FakeUpstreams(profile) as fakes: ...`.
+
+    A separate process keeps the fakes' CPU and memory out of whatever the
+    load test measures; `pid` identifies it for separate reporting.
+    """
+
+    def __init__(self, profile: FakeProfile, host: str = "127.0.0.1", port: int = 9100,
+                 startup_timeout: float = 30.0):
+        self.profile = profile
+        self.host = host
+        self.port = port
+        self.startup_timeout = startup_timeout
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+
+    def env(self) -> Dict[str, str]:
+        """Environment variables that point the backend at these fakes."""
+        return {
+            "GEMINI_API_ENDPOINT": self.url,
+            "GEMINI_API_KEY": "fake-key",  # The fakes accept any key
+            "OPENPETFOODFACTS_URL": f"{self.url}/api/v0",
+        }
+
+    def calls(self) -> Dict[str, int]:
+        return httpx.get(f"{self.url}/_fake/calls", timeout=5).json()
+
+    def __enter__(self) -> "FakeUpstreams":
+        backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.fakes", "--host", self.host, "--port", str(self.port),
+             "--profile-json", json.dumps(self.profile.to_dict())],
+            cwd=backend_dir,
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Fake upstreams exited with code {self.process.returncode}")
+            try:
+                self.calls()
+                return self
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    self.__exit__()
+                    raise RuntimeError(f"Fake upstreams did not start on {self.url}")
+                time.sleep(0.1)
+
+    def __exit__(self, *exc) -> None:
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve fake Gemini/OpenPetFoodFacts upstreams")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic")
+    parser.add_argument("--profile-json", default=None, help="A FakeProfile as JSON; overrides --profile")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+    profile = FakeProfile.from_dict(json.loads(args.profile_json)) if args.profile_json else PROFILES[args.profile]
+    uvicorn.run(create_fake_app(profile), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,307 @@
+"""
+Recall-versus-latency evaluation for `pet_chunks` retrieval.
+
+    cd backend
+    python -m benchmarks.retrieval_eval --queries labelled.jsonl \\
+        --chunking current,percentile:70:512,percentile:90:256 \\
+        --top-k 1,3,5,10 --hnsw-m 16,32 --hnsw-construction-ef 100,200 --hnsw-search-ef 10,50,100
+
+The query file has one JSON object per line:
+
+    {"query": "How often should a puppy eat?", "answer_spans": ["puppies should be fed"]}
+    {"query": "Signs of kidney disease in cats", "relevant_ids": ["42", "43"]}
+
+A chunk counts as relevant when it contains one of the query's
+`answer_spans` (case and whitespace are ignored), which survives
+re-chunking. `relevant_ids` are ids in the current collection and only
+apply to the `current` chunking. Chunking specs are
+`<threshold_type>:<amount>:<min_chunk_size>` for SemanticChunker over
+data/data.pdf, or `current` for the existing collection as ingested.
+
+Each chunking is searched exactly (numpy brute force, what serve.py's
+snapshot does) and with Chroma HNSW for every M/construction_ef/search_ef
+combination. The report lists recall@k, hit rate@k and MRR, index size,
+build time and per-query search latency. Query-embedding time is left
+out because it is the same for every configuration. Embeddings are cached
+under benchmarks/.embedding_cache so repeated sweeps don't spend quota.
+The fastest configuration whose recall@k is within --recall-tolerance of
+the best is printed as the recommendation.
+
+Embeddings use the same task types as serving: queries go through
+embed_query (RETRIEVAL_QUERY) like chatbot.get_relevant_passage, and
+re-chunked passages through embed_query like ingestall.py stores them, so
+they match the `current` collection. --document-task document embeds
+passages as RETRIEVAL_DOCUMENT instead, to measure that change on its own.
+The cache is keyed by task type as well as text.
+"""
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import itertools
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Take the bulk share of the upstream quota so an eval can run next to the server
+os.environ.setdefault("UPSTREAM_ROLE", "bulk")
+import startup
+from upstreamScheduler import ScheduledEmbeddings, Priority
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+EMBEDDING_CACHE_DIR = os.path.join(BENCH_DIR, ".embedding_cache")
+PDF_PATH = os.path.join(os.path.dirname(BENCH_DIR), "data", "data.pdf")
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class CachedEmbedder:
+    """Embeds texts through the scheduler, caching vectors on disk by task type and content hash."""
+
+    def __init__(self, cache_dir: str = EMBEDDING_CACHE_DIR):
+        self.embeddings = ScheduledEmbeddings(startup.get_embeddings(), priority=Priority.BULK)
+        self.cache_dir = cache_dir
+
+    def _path(self, text: str, task: str) -> str:
+        # The same text embeds differently as a query and as a document, so each task has its own cache
+        return os.path.join(self.cache_dir, task, hashlib.sha256(text.encode("utf-8")).hexdigest() + ".npy")
+
+    def _embed(self, texts: List[str], task: str) -> List[List[float]]:
+        os.makedirs(os.path.join(self.cache_dir, task), exist_ok=True)
+        missing = [t for t in dict.fromkeys(texts) if not os.path.exists(self._path(t, task))]
+        for start in range(0, len(missing), 100):
+            batch = missing[start:start + 100]
+            if task == "document":
+                vectors = self.embeddings.embed_documents(batch)
+            else:
+                vectors = [self.embeddings.embed_query(text) for text in batch]
+            for text, vector in zip(batch, vectors):
+                np.save(self._path(text, task), np.asarray(vector, dtype=np.float32))
+        return [np.load(self._path(t, task)).tolist() for t in texts]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """RETRIEVAL_DOCUMENT vectors; also what SemanticChunker uses to place breakpoints, as in ingestall.py."""
+        return self._embed(texts, "document")
+
+    def embed_query(self, text: str) -> List[float]:
+        """RETRIEVAL_QUERY vector, as chatbot.get_relevant_passage embeds the user's question."""
+        return self._embed([text], "query")[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "query")
+
+
+def load_queries(path: str) -> List[Dict]:
+    with open(path) as f:
+        queries = [json.loads(line) for line in f if line.strip()]
+    for q in queries:
+        q["answer_spans"] = [_normalize(s) for s in q.get("answer_spans", [])]
+        q["relevant_ids"] = [str(i) for i in q.get("relevant_ids", [])]
+    return queries
+
+
+def load_chunks(spec: str, embedder: CachedEmbedder, document_task: str = "query") -> Dict:
+    """Return ids, documents and float32 embeddings for a chunking spec."""
+    if spec == "current":
+        data = startup.get_collection().get(include=["embeddings", "documents"])
+        return {"ids": [str(i) for i in data["ids"]], "documents": data["documents"],
+                "embeddings": np.asarray(data["embeddings"], dtype=np.float32)}
+
+    from langchain_experimental.text_splitter import SemanticChunker
+    from ingestall import read_pdf
+
+    threshold_type, amount, min_chunk_size = spec.split(":")
+    splitter = SemanticChunker(embedder, breakpoint_threshold_type=threshold_type,
+                               breakpoint_threshold_amount=float(amount), min_chunk_size=int(min_chunk_size))
+    documents = [doc.page_content for doc in splitter.create_documents([read_pdf(PDF_PATH)])]
+    vectors = embedder.embed_queries(documents) if document_task == "query" else embedder.embed_documents(documents)
+    return {"ids": [str(i) for i in range(len(documents))], "documents": documents,
+            "embeddings": np.asarray(vectors, dtype=np.float32)}
+
+
+def relevant_indices(query: Dict, chunks: Dict, spec: str) -> Optional[set]:
+    """Indices of relevant chunks, or None when the query has no usable labels for this chunking."""
+    relevant = set()
+    if query["answer_spans"]:
+        for i, doc in enumerate(chunks["documents"]):
+            text = _normalize(doc or "")
+            if any(span in text for span in query["answer_spans"]):
+                relevant.add(i)
+    if query["relevant_ids"] and spec == "current":
+        id_index = {chunk_id: i for i, chunk_id in enumerate(chunks["ids"])}
+        relevant.update(id_index[i] for i in query["relevant_ids"] if i in id_index)
+    if not query["answer_spans"] and not (query["relevant_ids"] and spec == "current"):
+        return None
+    return relevant
+
+
+def score(rankings: List[List[int]], labels: List[set], top_k: Sequence[int]) -> Dict:
+    metrics = {}
+    for k in top_k:
+        recalls, hits = [], []
+        for ranking, relevant in zip(rankings, labels):
+            found = len(relevant & set(ranking[:k]))
+            recalls.append(found / len(relevant) if relevant else 0.0)
+            hits.append(1.0 if found else 0.0)
+        metrics[f"recall@{k}"] = round(float(np.mean(recalls)), 4) if recalls else None
+        metrics[f"hit@{k}"] = round(float(np.mean(hits)), 4) if hits else None
+    reciprocal = []
+    for ranking, relevant in zip(rankings, labels):
+        rank = next((pos for pos, idx in enumerate(ranking, 1) if idx in relevant), None)
+        reciprocal.append(1.0 / rank if rank else 0.0)
+    metrics[f"mrr@{max(top_k)}"] = round(float(np.mean(reciprocal)), 4) if reciprocal else None
+    return metrics
+
+
+def latency_stats(seconds: List[float]) -> Dict:
+    ms = np.asarray(seconds) * 1000
+    return {"search_p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "search_p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "search_mean_ms": round(float(ms.mean()), 3)}
+
+
+def _dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def evaluate_exact(chunks: Dict, query_vectors: np.ndarray, k: int) -> Dict:
+    vectors = chunks["embeddings"]
+    sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+    k = min(k, len(vectors))
+    rankings, latencies = [], []
+    for q in query_vectors:
+        started = time.perf_counter()
+        dist = sq_norms - 2.0 * (vectors @ q)
+        top = np.argpartition(dist, k - 1)[:k]
+        top = top[np.argsort(dist[top])]
+        latencies.append(time.perf_counter() - started)
+        rankings.append(top.tolist())
+    return {"rankings": rankings, "latencies": latencies,
+            "index_bytes": int(vectors.nbytes + sq_norms.nbytes), "build_seconds": 0.0}
+
+
+def evaluate_hnsw(chunks: Dict, query_vectors: np.ndarray, k: int, m: int, construction_ef: int,
+                  search_ef: int) -> Dict:
+    import chromadb
+
+    tmp_dir = tempfile.mkdtemp(prefix="petoai-hnsw-")
+    try:
+        client = chromadb.PersistentClient(path=tmp_dir)
+        collection = client.create_collection(name="eval", metadata={
+            "hnsw:space": "l2", "hnsw:M": m, "hnsw:construction_ef": construction_ef, "hnsw:search_ef": search_ef,
+        })
+        started = time.perf_counter()
+        for start in range(0, len(chunks["ids"]), 1000):
+            end = start + 1000
+            collection.add(ids=[str(i) for i in range(start, min(end, len(chunks["ids"])))],
+                           embeddings=chunks["embeddings"][start:end].tolist())
+        build_seconds = time.perf_counter() - started
+
+        rankings, latencies = [], []
+        for q in query_vectors:
+            started = time.perf_counter()
+            result = collection.query(query_embeddings=[q.tolist()], n_results=min(k, len(chunks["ids"])),
+                                      include=[])
+            latencies.append(time.perf_counter() - started)
+            rankings.append([int(i) for i in result["ids"][0]])
+        index_bytes = _dir_size(tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return {"rankings": rankings, "latencies": latencies, "index_bytes": index_bytes,
+            "build_seconds": round(build_seconds, 3)}
+
+
+def recommend(rows: List[Dict], k: int, tolerance: float) -> Optional[Dict]:
+    """Fastest configuration whose recall@k is within `tolerance` of the best one."""
+    key = f"recall@{k}"
+    scored = [r for r in rows if r.get(key) is not None]
+    if not scored:
+        return None
+    best = max(r[key] for r in scored)
+    eligible = [r for r in scored if r[key] >= best - tolerance]
+    return min(eligible, key=lambda r: r["search_p95_ms"])
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep retrieval configurations for recall and latency")
+    parser.add_argument("--queries", required=True, help="JSONL file of labelled queries")
+    parser.add_argument("--chunking", default="current")
+    parser.add_argument("--top-k", default="1,3,5,10")
+    parser.add_argument("--hnsw-m", default="16")
+    parser.add_argument("--hnsw-construction-ef", default="100")
+    parser.add_argument("--hnsw-search-ef", default="10,50,100")
+    parser.add_argument("--document-task", choices=["query", "document"], default="query",
+                        help="Task type for re-chunked passages; 'query' matches how ingestall.py stores them")
+    parser.add_argument("--no-exact", action="store_true", help="Skip the brute-force baseline")
+    parser.add_argument("--recall-tolerance", type=float, default=0.02)
+    parser.add_argument("--recommend-k", type=int, default=5, help="The k used by the chat endpoint (n_results)")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    top_k = _ints(args.top_k)
+    if args.recommend_k not in top_k:
+        # Only the --top-k values are measured, so there would be nothing to recommend from
+        parser.error(f"--recommend-k {args.recommend_k} must be one of --top-k {args.top_k}")
+    max_k = max(top_k)
+    queries = load_queries(args.queries)
+    embedder = CachedEmbedder()
+    query_vectors_all = np.asarray(embedder.embed_queries([q["query"] for q in queries]), dtype=np.float32)
+
+    rows = []
+    for spec in args.chunking.split(","):
+        chunks = load_chunks(spec, embedder, args.document_task)
+        labelled = [(i, rel) for i, rel in ((i, relevant_indices(q, chunks, spec)) for i, q in enumerate(queries))
+                    if rel is not None]
+        if not labelled or not chunks["ids"]:
+            print(f"{spec}: no chunks or no usable labels, skipped")
+            continue
+        query_vectors = query_vectors_all[[i for i, _ in labelled]]
+        labels = [rel for _, rel in labelled]
+        base = {"chunking": spec, "chunks": len(chunks["ids"]), "queries": len(labelled),
+                "unanswerable_queries": sum(1 for rel in labels if not rel)}
+
+        runs = []
+        if not args.no_exact:
+            runs.append(({"search": "exact"}, evaluate_exact(chunks, query_vectors, max_k)))
+        for m, cef, sef in itertools.product(_ints(args.hnsw_m), _ints(args.hnsw_construction_ef),
+                                             _ints(args.hnsw_search_ef)):
+            params = {"search": "hnsw", "M": m, "construction_ef": cef, "search_ef": sef}
+            runs.append((params, evaluate_hnsw(chunks, query_vectors, max_k, m, cef, sef)))
+
+        for params, run in runs:
+            row = {**base, **params, **score(run["rankings"], labels, top_k), **latency_stats(run["latencies"]),
+                   "index_bytes": run["index_bytes"], "build_seconds": run["build_seconds"]}
+            rows.append(row)
+            print(f"{spec:<22} {json.dumps(params):<64} recall@{args.recommend_k}="
+                  f"{row.get(f'recall@{args.recommend_k}')} mrr={row[f'mrr@{max_k}']} "
+                  f"p95={row['search_p95_ms']}ms size={row['index_bytes'] / 2 ** 20:.1f}MB "
+                  f"build={row['build_seconds']}s")
+
+    best = recommend(rows, args.recommend_k, args.recall_tolerance)
+    if best:
+        print(f"\nRecommended (fastest within {args.recall_tolerance} recall@{args.recommend_k} of best): "
+              + json.dumps({k: best[k] for k in ("chunking", "search", "M", "construction_ef", "search_ef")
+                            if k in best}))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-retrieval.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"started_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "queries_file": args.queries,
+                   "top_k": top_k, "document_task": args.document_task, "rows": rows,
+                   "recommended": best}, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
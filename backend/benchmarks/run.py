@@ -0,0 +1,279 @@
+"""
+Offline load test for the backend.
+
+    cd backend
+    python -m benchmarks.run --profile realistic --concurrency 1,8,32 --requests 200
+
+Starts the fake upstreams (benchmarks/fakes.py), points the app at them and
+drives /chatapi/generate_answer, /chatapi/analyze-image/ and
+/dietplanner/generate-diet-plan at each concurrency level. By default the
+main.py app runs in-process; pass --url to load an already running server
+(start it with the env printed by `python -m benchmarks.fakes`). Results are
+written to benchmarks/results/<timestamp>-<profile>.json; compare two runs
+with `python -m benchmarks.compare old.json new.json`.
+
+--profile-json takes a custom FakeProfile (see benchmarks/fakes.py) instead
+of a preset. --upstream-limits sets UPSTREAM_LIMITS for the app, e.g.
+'{"gemini-1.5-flash": {"rps": 20, "burst": 40, "concurrency": 32}}'; with
+--url it is only printed with the env to start the server with. Every
+report records the limits in effect, since they bound throughput as much
+as the code under test does.
+
+Memory is sampled from /proc for the process under test and all of its
+children: this process in-process mode (app plus load client), or the
+server given by --pid with --url (pass the serve.py parent to cover every
+worker). The fakes run in their own process and are reported separately.
+"""
+import os
+import io
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+from contextlib import AsyncExitStack
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from PIL import Image
+
+from benchmarks.fakes import PROFILES, FakeProfile, FakeUpstreams
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def _sample_image() -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (512, 512), (180, 120, 90)).save(out, format="JPEG")
+    return out.getvalue()
+
+
+SAMPLE_IMAGE = _sample_image()
+
+SCENARIOS: Dict[str, Callable] = {
+    "chat": lambda client, i: client.post("/chatapi/generate_answer", json={
+        "query": f"How often should I feed my {i % 12 + 1} month old puppy",
+        "language": "English",
+    }),
+    "vision": lambda client, i: client.post("/chatapi/analyze-image/", files={
+        "file": (f"pet-{i}.jpg", SAMPLE_IMAGE, "image/jpeg"),
+    }),
+    "diet": lambda client, i: client.post("/dietplanner/generate-diet-plan", json={
+        "petProfile": {
+            "name": f"Bench {i}",
+            "age": "4 years",
+            "breed": "Labrador",
+            "weight": str(20 + i % 15),
+            "activityLevel": "Medium",
+            "healthConditions": ["Joint Issues"],
+        },
+        "dietaryPreferences": {
+            "foodTypes": ["Dry Food", "Wet Food"],
+            "allergens": [],
+            "customRestrictions": "None",
+        },
+    }),
+}
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _process_tree(pid: int, exclude: Optional[int] = None) -> List[int]:
+    """`pid` and all of its descendants (minus the `exclude` subtree), from the parent ids in /proc/<pid>/stat."""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, so split after its closing parenthesis
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        if current == exclude:
+            continue
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def process_memory(pid: Optional[int], exclude: Optional[int] = None) -> Dict[str, Optional[float]]:
+    """Current and peak resident memory (MB) of `pid` plus its children; None when it can't be read."""
+    current = peak = 0
+    try:
+        for member in _process_tree(pid, exclude) if pid else []:
+            try:
+                with open(f"/proc/{member}/status") as f:
+                    status = dict(line.split(":", 1) for line in f if ":" in line)
+            except OSError:
+                continue  # Exited since the tree was listed
+            current += int(status.get("VmRSS", "0 kB").split()[0])
+            peak += int(status.get("VmHWM", "0 kB").split()[0])
+    except OSError:
+        pass  # No /proc (e.g. macOS)
+    if not peak:
+        return {"rss_mb": None, "peak_rss_mb": None}
+    return {"rss_mb": round(current / 1024, 1), "peak_rss_mb": round(peak / 1024, 1)}
+
+
+async def run_level(client: httpx.AsyncClient, scenario: str, concurrency: int, total: int,
+                    target_pid: Optional[int] = None, fakes_pid: Optional[int] = None) -> Dict:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await SCENARIOS[scenario](client, i)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 1) if v is not None else None
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(total / wall, 2) if wall else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+        "statuses": statuses,
+        "error_rate": round(1 - statuses.get("200", 0) / total, 4) if total else 0,
+        # The fakes are a child of this process in-process mode; keep them out of the target's numbers
+        **process_memory(target_pid, exclude=fakes_pid),
+        "fakes_rss_mb": process_memory(fakes_pid)["rss_mb"],
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main_async(args) -> Dict:
+    levels = [int(c) for c in args.concurrency.split(",")]
+    scenarios = args.scenarios.split(",")
+    profile = FakeProfile.from_dict(json.loads(args.profile_json)) if args.profile_json else PROFILES[args.profile]
+    if args.upstream_limits is not None:
+        json.loads(args.upstream_limits)  # Fail before starting anything if it isn't JSON
+        os.environ["UPSTREAM_LIMITS"] = args.upstream_limits
+    effective_limits = None
+
+    with FakeUpstreams(profile, port=args.fake_port) as fakes:
+        async with AsyncExitStack() as stack:
+            if args.url:
+                server_env = dict(fakes.env())
+                if args.upstream_limits is not None:
+                    server_env["UPSTREAM_LIMITS"] = f"'{args.upstream_limits}'"
+                print(f"Load-testing {args.url}; start it with: "
+                      + " ".join(f"{k}={v}" for k, v in server_env.items()))
+                if args.pid is None:
+                    print("No --pid given; server memory will not be reported")
+                target_pid = args.pid
+                client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+            else:
+                target_pid = os.getpid()
+                # Module-level settings read the environment, so set it before importing the app
+                os.environ.update(fakes.env())
+                from main import app
+                from upstreamScheduler import scheduler
+                effective_limits = scheduler.limits()
+                await stack.enter_async_context(app.router.lifespan_context(app))
+                transport = httpx.ASGITransport(app=app)
+                client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout)
+            await stack.enter_async_context(client)
+
+            results = []
+            for scenario in scenarios:
+                await run_level(client, scenario, 1, min(args.warmup, args.requests))
+                for concurrency in levels:
+                    result = await run_level(client, scenario, concurrency, args.requests,
+                                             target_pid=target_pid, fakes_pid=fakes.pid)
+                    results.append(result)
+                    print(f"{scenario:>6} c={concurrency:<4} {result['requests_per_second']:>8} req/s  "
+                          f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms  "
+                          f"errors={result['error_rate']:.1%}")
+
+        upstream_calls = fakes.calls()
+
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "target": args.url or "in-process",
+        # What peak_rss_mb covers; only compare runs whose memory_scope matches
+        "memory_scope": ("in-process app and load client" if not args.url
+                         else f"pid {args.pid} and children" if args.pid else None),
+        "profile_name": profile_name(args),
+        "profile": profile.to_dict(),
+        "upstream_limits": {
+            # As configured for the target; with --url only known if it was started with the printed env
+            "configured": os.getenv("UPSTREAM_LIMITS"),
+            "bulk_share": os.getenv("UPSTREAM_BULK_SHARE"),
+            "gemini_shared_rps": os.getenv("GEMINI_SHARED_RPS"),
+            # Per-process limits the in-process app applied; None with --url
+            "effective": effective_limits,
+        },
+        "upstream_calls": upstream_calls,
+        "results": results,
+    }
+
+
+def profile_name(args) -> str:
+    return "custom" if args.profile_json else args.profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test against fake upstreams")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic")
+    parser.add_argument("--profile-json", default=None, help="A FakeProfile as JSON; overrides --profile")
+    parser.add_argument("--upstream-limits", default=None,
+                        help="UPSTREAM_LIMITS JSON for the app under test, merged over the defaults")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--url", default=None, help="Load an external server instead of the in-process app")
+    parser.add_argument("--pid", type=int, default=None,
+                        help="With --url, the server process to sample memory from (children included)")
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{profile_name(args)}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,84 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-import chromadb
-import google.generativeai as genai
-from typing import List
+from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
 import re
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from visionModel import analyze_image
+from promptRegistry import registry
+from supdatabase.profile_service import profile_service, describe_pet
+import startup
+from tracing import stage, record_usage
+from singleflight import chat_flight, vision_flight, fingerprint
+from upstreamScheduler import scheduler, Priority, UpstreamOverloaded
+import hashlib
 
 app = FastAPI()
 
-# Load ChromaDB
-db_path = "chroma_rag_data"
-db_name = "pet_chunks"
-
-def load_chroma_db(path: str, name: str, dimension: int = 768):
-    chroma_client = chromadb.PersistentClient(path=path)
-    try:
-        collection = chroma_client.get_collection(name=name)
-    except chromadb.errors.InvalidCollectionException:
-        collection = chroma_client.create_collection(name=name, dimension=dimension)
-    return collection
-
-db = load_chroma_db(db_path, db_name)
-
-# Initialize embedding function
-embedding_function = GoogleGenerativeAIEmbeddings(
-    model="models/embedding-001",
-    google_api_key=" "
-)
+@app.exception_handler(UpstreamOverloaded)
+async def upstream_overloaded_handler(request, exc):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(int(exc.retry_after), 1))}
+    )
 
 # Update QueryRequest to include language
 class QueryRequest(BaseModel):
     query: str
     language: str  # e.g., "English", "Kannada", etc.
+    pet_id: Optional[str] = None  # Personalize the answer with a stored pet profile
+    user_id: Optional[str] = None  # Owner of pet_id; required when pet_id is set
 
 # Function to retrieve relevant passages using embeddings
-def get_relevant_passage(query: str, db, embedding_function, n_results: int = 5):
-    query_embedding = embedding_function.embed_query(query)
-    results = db.query(query_embeddings=[query_embedding], n_results=n_results)
+async def get_relevant_passage(query: str, db, embedding_function, n_results: int = 5):
+    with stage("embed_query"):
+        query_embedding = await scheduler.acall("embedding-001", embedding_function.embed_query, query,
+                                                priority=Priority.INTERACTIVE)
+    with stage("db_query"):
+        # Chroma is blocking; keep it off the event loop
+        results = await run_in_threadpool(db.query, query_embeddings=[query_embedding], n_results=n_results)
     return [passage for doc in results["documents"] for passage in doc]
 
-def refine_query(query: str) -> str:
+REFINE_SYSTEM_PROMPT = (
+    "You are an expert in query understanding. Your task is to refine the given user query to make it clearer, "
+    "without changing its meaning. Keep it concise, more specific, and well-structured for better information retrieval.\n\n"
+    "If there are any grammar mistakes, correct them.\n\n"
+    "If the user is asking a question but has not included a question mark, convert it into a proper question."
+)
+
+RAG_SYSTEM_PROMPT = (
+    "You are a professional, knowledgeable, and friendly Petcare Virtual Assistant. "
+    "Your goal is to help pet owners with reliable and practical advice on pet health, symptoms, cures, nutrition, grooming, and behavior. "
+    "Your responses should be detailed, well-structured, and easy to understand. Provide examples when needed.\n\n"
+
+    "### Instructions:\n"
+    "1. If the user greets (e.g., 'hi', 'hello', 'hey'), respond politely with a warm greeting.\n"
+    "2. If the user asks about pet care, provide thorough and structured advice. Avoid short answers.\n"
+    "3. Use the given context (if available) to answer the query. If the context is insufficient, rely on your own knowledge.\n"
+    "4. Always provide additional useful advice to enhance the user's understanding.\n"
+    "5. Keep responses professional yet friendly, making pet owners feel comfortable and confident.\n"
+    "6. IMPORTANT: Answer ONLY in the language requested with the query. Do not include any words in any other language.\n"
+)
+
+# Static prefixes are registered once and reused by handle on every request
+registry.register("refine_query", REFINE_SYSTEM_PROMPT, "gemini-1.5-flash",
+                  generation_config={"temperature": 0.3})
+registry.register("rag_answer", RAG_SYSTEM_PROMPT, "gemini-1.5-flash",
+                  generation_config={"temperature": 0.3, "max_output_tokens": 1024})
+
+async def refine_query(query: str) -> str:
     refine_prompt = (
-        f"You are an expert in query understanding. Your task is to refine the given user query to make it clearer, "
-        f"without changing its meaning. Keep it concise, more specific, and well-structured for better information retrieval.\n\n"
-        f"If there are any grammar mistakes, correct them.\n\n"
-        f"If the user is asking a question but has not included a question mark, convert it into a proper question.\n\n"
         f"### User Query:\n{query}\n\n"
         f"### Refined Query:"
     )
 
-    genai.configure(api_key="")
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    result = model.generate_content(refine_prompt, generation_config={"temperature": 0.3})
+    # Building the model may create an upstream context cache, so it runs in the threadpool
+    model = await run_in_threadpool(registry.model, "refine_query")
+    with stage("refine_query"):
+        result = await scheduler.acall("gemini-1.5-flash", model.generate_content, refine_prompt,
+                                       priority=Priority.INTERACTIVE)
+    record_usage(registry.get("refine_query").model_name, result)
     return result.text.strip()
 
 def clean_text(text):
@@ -61,22 +86,14 @@ def clean_text(text):
     text = re.sub(r'\s+', ' ', text).strip()
     return text
 
-# Updated make_rag_prompt to include language parameter
-def make_rag_prompt(query: str, relevant_passages: List[str], language: str) -> str:
+# Only the per-request part of the prompt; the instructions live in RAG_SYSTEM_PROMPT
+def make_rag_prompt(query: str, relevant_passages: List[str], language: str, pet_context: str = "") -> str:
     cleaned_passages = " ".join([clean_text(passage) for passage in relevant_passages])
+    pet_section = f"### About the User's Pet:\n{pet_context}\n\n" if pet_context else ""
     
     prompt = (
-        f"You are a professional, knowledgeable, and friendly Petcare Virtual Assistant. "
-        f"Your goal is to help pet owners with reliable and practical advice on pet health, symptoms, cures, nutrition, grooming, and behavior. "
-        f"Your responses should be detailed, well-structured, and easy to understand. Provide examples when needed.\n\n"
-
-        f"### Instructions:\n"
-        f"1. If the user greets (e.g., 'hi', 'hello', 'hey'), respond politely with a warm greeting.\n"
-        f"2. If the user asks about pet care, provide thorough and structured advice. Avoid short answers.\n"
-        f"3. Use the given context (if available) to answer the query. If the context is insufficient, rely on your own knowledge.\n"
-        f"4. Always provide additional useful advice to enhance the user's understanding.\n"
-        f"5. Keep responses professional yet friendly, making pet owners feel comfortable and confident.\n\n"
-        f"6. IMPORTANT: Answer ONLY in {language}. Do not include any words in any other language.\n\n"
+        f"### Response Language:\n{language}\n\n"
+        f"{pet_section}"
         f"### User Query:\n{query}\n\n"
         f"### Relevant Context (if available):\n{cleaned_passages}\n\n"
         f"### Your Response:"
@@ -84,34 +101,48 @@ def make_rag_prompt(query: str, relevant_passages: List[str], language: str) ->
     return prompt
 
 
-def generate_answer(prompt: str) -> str:
-    genai.configure(api_key="")
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    result = model.generate_content(
-        prompt,
-        generation_config={
-            "temperature": 0.3, 
-            "max_output_tokens": 1024 
-        }
-    )
+async def generate_answer(prompt: str) -> str:
+    model = await run_in_threadpool(registry.model, "rag_answer")
+    with stage("generate_answer"):
+        result = await scheduler.acall("gemini-1.5-flash", model.generate_content, prompt,
+                                       priority=Priority.INTERACTIVE)
+    record_usage(registry.get("rag_answer").model_name, result)
     return result.text
 
 @app.post("/generate_answer")
-def generate_response(request: QueryRequest):
+async def generate_response(request: QueryRequest):
     query = request.query
     language = request.language  # Capture the language selected in the frontend
     if not query:
         raise HTTPException(status_code=400, detail="Query cannot be empty")
-    
-    refined_query = refine_query(query)
-    relevant_passages = get_relevant_passage(refined_query, db, embedding_function)
+
+    pet_context = ""
+    if request.pet_id:
+        if not request.user_id:
+            raise HTTPException(status_code=400, detail="user_id is required with pet_id")
+        row = await profile_service.get_owned(request.pet_id, request.user_id)
+        if row is None:
+            raise HTTPException(status_code=404, detail="Pet profile not found")
+        pet_context = describe_pet(row)
+
+    # Identical questions arriving together share one pipeline run
+    return await chat_flight.do(
+        fingerprint(query, language, pet_context), answer_query, query, language, pet_context
+    )
+
+async def answer_query(query: str, language: str, pet_context: str = ""):
+    # Upstream calls queue on the event loop and only take a threadpool thread once admitted
+    refined_query = await refine_query(query)
+    relevant_passages = await get_relevant_passage(
+        refined_query, startup.get_retriever(), startup.get_embeddings()
+    )
     
     if not relevant_passages:
         return {"message": "No relevant passages found.", "response": "I'm sorry, but I couldn't find relevant information."}
     
     # Pass language to the prompt template
-    prompt = make_rag_prompt(refined_query, relevant_passages, language)
-    answer = generate_answer(prompt)
+    prompt = make_rag_prompt(refined_query, relevant_passages, language, pet_context)
+    answer = await generate_answer(prompt)
     
     return {"refined_query": refined_query, "response": answer}
 
@@ -125,11 +156,15 @@ async def analyze_image_route(file: UploadFile = File(...)):
             raise HTTPException(status_code=400, detail="Invalid file type. Please upload a PNG, JPG, or JPEG image.")
 
         image_data = await file.read()
-        analysis_result = analyze_image(image_data, file.content_type)
+        # Retried or duplicated uploads of the same image share one analysis
+        key = fingerprint(hashlib.sha256(image_data).hexdigest(), file.content_type)
+        analysis_result = await vision_flight.do(key, analyze_image, image_data, file.content_type)
         return JSONResponse(content={
             "status": "success",
             "analysis": analysis_result
         })
 
+    except (HTTPException, UpstreamOverloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
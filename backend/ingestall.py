@@ -9,6 +9,10 @@ from chromadb import PersistentClient
 import logging
 import numpy as np
 
+# Take the bulk share of the upstream quota so ingest can run next to the server
+os.environ.setdefault("UPSTREAM_ROLE", "bulk")
+from upstreamScheduler import ScheduledEmbeddings, Priority
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -25,10 +29,11 @@ pdfpath = "data/data.pdf"
 # Create a ChromaDB-compatible embedding function wrapper
 class ChromaEmbeddingFunction:
     def __init__(self, api_key: str):
-        self.embeddings = GoogleGenerativeAIEmbeddings(
+        # Ingest runs as bulk work so it never crowds out interactive traffic
+        self.embeddings = ScheduledEmbeddings(GoogleGenerativeAIEmbeddings(
             model="models/embedding-001",
             google_api_key=api_key
-        )
+        ), priority=Priority.BULK)
     
     def __call__(self, input: List[str]) -> List[List[float]]:
         """Convert input texts to embeddings."""
@@ -72,11 +77,11 @@ def read_text_file(text_path: str) -> str:
 def process_content(content: str) -> List:
     """Process content using semantic chunking."""
     try:
-        # Initialize embeddings
-        embeddings = GoogleGenerativeAIEmbeddings(
+        # Initialize embeddings (scheduled as bulk work)
+        embeddings = ScheduledEmbeddings(GoogleGenerativeAIEmbeddings(
             model="models/embedding-001",
             google_api_key=GOOGLE_API_KEY
-        )
+        ), priority=Priority.BULK)
         
         # Create semantic chunks
         text_splitter = SemanticChunker(
@@ -33,13 +33,40 @@
 
 
 
-from fastapi import FastAPI
+import startup  # loads backend/.env; keep it above imports that read settings at import time
+import os
+import time
+import anyio.to_thread
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from chatbot import app as chatbot_app
 from dietPlanner import app as dietplanner_app
+from supdatabase.auth import auth_router
+import supdatabase.pet_profiles  # registers the pet profile and photo routes on auth_router
+from supdatabase.supabase_client import close_supabase
+import tracing
+from upstreamScheduler import scheduler
 import uvicorn
 
-app = FastAPI()
+THREADPOOL_HEADROOM = int(os.getenv("THREADPOOL_HEADROOM", "40"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Every admitted upstream call holds a threadpool thread; size the pool so that, with all
+    # upstream slots busy, Chroma queries and the food search still get threads
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, scheduler.total_concurrency() + THREADPOOL_HEADROOM)
+    # Mounted sub-apps don't get lifespan events, so shared resources are built here once
+    app.state.startup_report = await run_in_threadpool(startup.warm_up)
+    yield
+    await close_supabase()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -56,6 +83,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def route_label(request: Request, root_path: str) -> str:
+    """The matched route template (mount prefix included), so ids and probes don't create new series."""
+    route = request.scope.get("route")
+    if route is None:
+        return "unmatched"  # 404s, 405s and redirects
+    mount_prefix = request.scope.get("root_path", "")[len(root_path):]
+    return mount_prefix + route.path
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    trace = tracing.start_trace(request.headers.get("x-trace-id"))
+    root_path = request.scope.get("root_path", "")
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+
+    route = route_label(request, root_path)
+    tracing.request_seconds.observe(elapsed, route=route, status=response.status_code)
+    tracing.log_trace(trace, route, elapsed)
+
+    response.headers["X-Trace-Id"] = trace.trace_id
+    if trace.sampled and trace.stages:
+        response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
 # A simple root endpoint that responds with a welcome message
 @app.get("/")
 async def root():
@@ -69,6 +121,20 @@ async def get_signin():
 async def get_signup():
     return {"message": "Sign Up Page - Render your sign-up UI here"}
 
+@app.get("/startup")
+async def get_startup_report():
+    """Per-component startup timings; components built lazily later are included once ready."""
+    report = startup.startup_report()
+    report["warm_up_ms"] = getattr(app.state, "startup_report", {}).get("warm_up_ms")
+    return report
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of this process's metrics."""
+    return PlainTextResponse(tracing.render_metrics(), media_type="text/plain; version=0.0.4")
+
+app.include_router(auth_router)
+
 # Mount your other backend modules
 app.mount("/chatapi", chatbot_app)
 app.mount("/diseaseapi", chatbot_app)
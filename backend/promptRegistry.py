@@ -0,0 +1,227 @@
+import os
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import startup
+from tracing import record_cache
+from upstreamScheduler import scheduler, Priority
+
+# Gemini 1.5 only accepts explicit context caches above this many input tokens.
+# Shorter prefixes are sent as system instructions instead.
+MIN_CACHE_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "32768"))
+CACHE_TTL = timedelta(minutes=int(os.getenv("PROMPT_CACHE_TTL_MINUTES", "60")))
+# Re-create an upstream cache this long before it expires
+CACHE_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) used to pick a caching strategy."""
+    return len(text) // 4
+
+
+@dataclass
+class PromptHandle:
+    """A registered static prompt prefix and the model settings it is used with."""
+    name: str
+    model_name: str
+    text: str
+    generation_config: Optional[Dict[str, Any]] = None
+    safety_settings: Optional[List[Dict[str, str]]] = None
+    digest: str = ""
+    cached_content_name: Optional[str] = None
+    expires_at: Optional[datetime] = None
+
+    def __post_init__(self):
+        self.digest = hashlib.sha256(f"{self.model_name}\n{self.text}".encode("utf-8")).hexdigest()
+
+    @property
+    def is_cached(self) -> bool:
+        if not self.cached_content_name or not self.expires_at:
+            return False
+        return datetime.now(timezone.utc) + CACHE_REFRESH_MARGIN < self.expires_at
+
+
+class GeminiPromptBackend:
+    """Registers prefixes with Gemini, as cached contexts when large enough, else as system instructions."""
+
+    def __init__(self, min_cache_tokens: int = MIN_CACHE_TOKENS, ttl: timedelta = CACHE_TTL):
+        self.min_cache_tokens = min_cache_tokens
+        self.ttl = ttl
+
+    def _create_cache(self, handle: PromptHandle) -> None:
+        genai = startup.get_genai()
+        cached = scheduler.call(
+            handle.model_name,
+            genai.caching.CachedContent.create,
+            priority=Priority.STANDARD,
+            model=f"models/{handle.model_name}",
+            display_name=f"petoai-{handle.name}-{handle.digest[:12]}",
+            system_instruction=handle.text,
+            ttl=self.ttl,
+        )
+        handle.cached_content_name = cached.name
+        handle.expires_at = datetime.now(timezone.utc) + self.ttl
+        logging.info(f"Created context cache {cached.name} for prompt '{handle.name}'")
+
+    def _use_cache(self, handle: PromptHandle) -> bool:
+        if estimate_tokens(handle.text) < self.min_cache_tokens:
+            return False
+        record_cache("context_cache", hit=handle.is_cached)
+        if not handle.is_cached:
+            try:
+                self._create_cache(handle)
+            except Exception as e:
+                logging.warning(f"Context cache unavailable for prompt '{handle.name}': {str(e)}")
+                handle.cached_content_name = None
+                return False
+        return True
+
+    def model(self, handle: PromptHandle):
+        genai = startup.get_genai()
+        if self._use_cache(handle):
+            cached = genai.caching.CachedContent.get(handle.cached_content_name)
+            return genai.GenerativeModel.from_cached_content(
+                cached_content=cached,
+                generation_config=handle.generation_config,
+                safety_settings=handle.safety_settings,
+            )
+        return genai.GenerativeModel(
+            model_name=handle.model_name,
+            system_instruction=handle.text,
+            generation_config=handle.generation_config,
+            safety_settings=handle.safety_settings,
+        )
+
+    def rest_fields(self, handle: PromptHandle) -> Dict[str, Any]:
+        """Fields to merge into a REST generateContent payload."""
+        if self._use_cache(handle):
+            return {"cachedContent": handle.cached_content_name}
+        return {"systemInstruction": {"parts": [{"text": handle.text}]}}
+
+
+class _LocalResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class LocalModel:
+    """Offline stand-in for genai.GenerativeModel that records the prompts it receives."""
+
+    def __init__(self, handle: PromptHandle):
+        self.handle = handle
+        self.calls: List[Any] = []
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        self.calls.append(contents)
+        return _LocalResponse(f"[{self.handle.name}] local response")
+
+
+class LocalPromptBackend:
+    """In-memory backend for tests: no network, one model per registered prefix."""
+
+    def __init__(self):
+        self.models: Dict[str, LocalModel] = {}
+
+    def model(self, handle: PromptHandle) -> LocalModel:
+        if handle.name not in self.models:
+            self.models[handle.name] = LocalModel(handle)
+        return self.models[handle.name]
+
+    def rest_fields(self, handle: PromptHandle) -> Dict[str, Any]:
+        # REST calls still go to a real endpoint, so send the prefix inline rather than a fake cache name
+        return {"systemInstruction": {"parts": [{"text": handle.text}]}}
+
+
+class PromptRegistry:
+    """
+    Holds the static prefixes used by each module and hands out models bound to them.
+
+    Prefixes are registered once at import time; nothing is sent upstream until
+    the first request asks for a model or REST payload fields.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or self._default_backend()
+        self._handles: Dict[str, PromptHandle] = {}
+        self._models: Dict[str, Any] = {}
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _default_backend():
+        if os.getenv("PROMPT_REGISTRY_BACKEND", "gemini").lower() == "local":
+            return LocalPromptBackend()
+        return GeminiPromptBackend()
+
+    def register(
+        self,
+        name: str,
+        text: str,
+        model_name: str,
+        generation_config: Optional[Dict[str, Any]] = None,
+        safety_settings: Optional[List[Dict[str, str]]] = None,
+    ) -> PromptHandle:
+        handle = PromptHandle(
+            name=name,
+            model_name=model_name,
+            text=text.strip(),
+            generation_config=generation_config,
+            safety_settings=safety_settings,
+        )
+        with self._lock:
+            existing = self._handles.get(name)
+            if existing and existing.digest == handle.digest:
+                return existing
+            self._handles[name] = handle
+            self._models.pop(name, None)
+        return handle
+
+    def get(self, name: str) -> PromptHandle:
+        try:
+            return self._handles[name]
+        except KeyError:
+            raise KeyError(f"Prompt prefix '{name}' is not registered")
+
+    def _build_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._build_locks.setdefault(name, threading.Lock())
+
+    def model(self, name: str):
+        """Return a generative model with the static prefix for `name` already attached."""
+        handle = self.get(name)
+        # Building may create an upstream cache, so it happens under a per-prompt lock
+        # rather than the registry lock; other prompts are not held up by the network call.
+        with self._build_lock(name):
+            with self._lock:
+                model = self._models.get(name)
+                backend = self.backend
+            # Cached contexts expire upstream; rebuild the model when the handle needs a refresh
+            rebuild = model is None or bool(handle.cached_content_name and not handle.is_cached)
+            if rebuild:
+                model = backend.model(handle)
+                with self._lock:
+                    if self.backend is backend:
+                        self._models[name] = model
+        record_cache("prompt_prefix", hit=not rebuild)
+        return model
+
+    def rest_fields(self, name: str) -> Dict[str, Any]:
+        handle = self.get(name)
+        with self._build_lock(name):
+            return self.backend.rest_fields(handle)
+
+    def use_backend(self, backend) -> None:
+        """Swap the backend (e.g. LocalPromptBackend in tests) and drop built models."""
+        with self._lock:
+            self.backend = backend
+            self._models.clear()
+            for handle in self._handles.values():
+                handle.cached_content_name = None
+                handle.expires_at = None
+
+
+registry = PromptRegistry()
@@ -0,0 +1,152 @@
+"""
+Read-only, memory-mapped export of the `pet_chunks` collection.
+
+In multi-worker mode (serve.py) the parent process writes one snapshot and
+every worker maps the same files, so the vectors and passages live once in
+the OS page cache instead of once per process. RetrievalSnapshot.query()
+mirrors Collection.query() so chatbot.get_relevant_passage works unchanged.
+
+Rebuild manually with `python retrievalSnapshot.py`, then send SIGHUP to
+the serve.py parent to roll the workers onto it.
+"""
+import os
+import json
+import mmap
+import time
+import shutil
+import hashlib
+import logging
+from typing import Dict, List
+
+import numpy as np
+
+SNAPSHOT_DIR = os.getenv("RETRIEVAL_SNAPSHOT_DIR", "retrieval_snapshot")
+MANIFEST = "manifest.json"
+
+
+def content_digest(ids: List[str], documents: List[str]) -> str:
+    """Hash of a collection's ids and passages, so a snapshot is rebuilt when any chunk changes."""
+    digest = hashlib.sha256()
+    for chunk_id, doc in zip(ids, documents):
+        for part in (chunk_id, doc or ""):
+            encoded = part.encode("utf-8")
+            digest.update(len(encoded).to_bytes(8, "little"))
+            digest.update(encoded)
+    return digest.hexdigest()
+
+
+def collection_digest(collection) -> str:
+    data = collection.get(include=["documents"])
+    return content_digest(data["ids"], data["documents"])
+
+
+def build_snapshot(collection, out_dir: str = SNAPSHOT_DIR) -> Dict:
+    """Export a Chroma collection's embeddings and documents to `out_dir`, replacing it atomically."""
+    started = time.perf_counter()
+    data = collection.get(include=["embeddings", "documents"])
+    if not data["ids"]:
+        vectors = np.zeros((0, 0), dtype=np.float32)
+    else:
+        vectors = np.asarray(data["embeddings"], dtype=np.float32)
+        if vectors.ndim != 2:
+            vectors = vectors.reshape(len(data["ids"]), -1)
+
+    encoded = [(doc or "").encode("utf-8") for doc in data["documents"]]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+
+    manifest = {
+        "collection": collection.name,
+        "count": len(data["ids"]),
+        "digest": content_digest(data["ids"], data["documents"]),
+        "dimension": int(vectors.shape[1]) if len(vectors) else 0,
+        "space": (collection.metadata or {}).get("hnsw:space", "l2"),
+        "built_at": time.time(),
+    }
+
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, "vectors.npy"), vectors)
+    np.save(os.path.join(tmp_dir, "sq_norms.npy"), np.einsum("ij,ij->i", vectors, vectors))
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+    with open(os.path.join(tmp_dir, "passages.bin"), "wb") as f:
+        f.write(b"".join(encoded) or b"\0")  # mmap cannot map an empty file
+    with open(os.path.join(tmp_dir, "ids.json"), "w") as f:
+        json.dump(data["ids"], f)
+    with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f)
+
+    # Workers that already mapped the old files keep reading them until they restart
+    old_dir = f"{out_dir}.old-{os.getpid()}"
+    if os.path.exists(out_dir):
+        os.rename(out_dir, old_dir)
+    os.rename(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    logging.info(f"Built retrieval snapshot of {manifest['count']} chunks in {time.perf_counter() - started:.2f}s")
+    return manifest
+
+
+def read_manifest(snapshot_dir: str = SNAPSHOT_DIR) -> Dict:
+    path = os.path.join(snapshot_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class RetrievalSnapshot:
+    """Exact nearest-neighbour search over a memory-mapped snapshot."""
+
+    def __init__(self, snapshot_dir: str = SNAPSHOT_DIR):
+        self.snapshot_dir = snapshot_dir
+        self.manifest = read_manifest(snapshot_dir)
+        if not self.manifest:
+            raise FileNotFoundError(f"No retrieval snapshot in {snapshot_dir}")
+
+        self.vectors = np.load(os.path.join(snapshot_dir, "vectors.npy"), mmap_mode="r")
+        self.sq_norms = np.load(os.path.join(snapshot_dir, "sq_norms.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(snapshot_dir, "offsets.npy"), mmap_mode="r")
+        with open(os.path.join(snapshot_dir, "passages.bin"), "rb") as f:
+            self.passages = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(os.path.join(snapshot_dir, "ids.json")) as f:
+            self.ids = json.load(f)
+        self.name = self.manifest["collection"]
+
+    def count(self) -> int:
+        return self.manifest["count"]
+
+    def passage(self, index: int) -> str:
+        return self.passages[self.offsets[index]:self.offsets[index + 1]].decode("utf-8")
+
+    def distances(self, query: np.ndarray) -> np.ndarray:
+        """Distances in the collection's space, matching what Chroma reports."""
+        dots = self.vectors @ query
+        if self.manifest["space"] == "cosine":
+            denom = np.sqrt(self.sq_norms) * np.linalg.norm(query)
+            return 1.0 - dots / np.maximum(denom, 1e-12)
+        if self.manifest["space"] == "ip":
+            return 1.0 - dots
+        return np.maximum(self.sq_norms - 2.0 * dots + float(query @ query), 0.0)
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 5, **kwargs) -> Dict:
+        result = {"ids": [], "documents": [], "distances": []}
+        k = min(n_results, self.count())
+        for embedding in query_embeddings:
+            if k == 0:
+                top = np.array([], dtype=np.int64)
+                dist = np.array([])
+            else:
+                dist = self.distances(np.asarray(embedding, dtype=np.float32))
+                top = np.argpartition(dist, k - 1)[:k]
+                top = top[np.argsort(dist[top])]
+            result["ids"].append([self.ids[i] for i in top])
+            result["documents"].append([self.passage(i) for i in top])
+            result["distances"].append([float(dist[i]) for i in top])
+        return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    import startup
+    print(json.dumps(build_snapshot(startup.get_collection()), indent=2))
@@ -0,0 +1,65 @@
+"""
+Multi-process server for the backend.
+
+    python serve.py --workers 4
+
+The parent opens Chroma once, exports `pet_chunks` to a memory-mapped
+retrieval snapshot (rebuilt when the collection's ids or passages change, or with
+--rebuild-snapshot) and then forks uvicorn workers that all map the same
+files. Send SIGHUP to the parent to restart workers gracefully (uvicorn >= 0.30),
+e.g. after rebuilding the snapshot with `python retrievalSnapshot.py`.
+`python main.py` still runs the single-process server.
+"""
+import os
+import argparse
+import logging
+import uvicorn
+
+import startup
+from retrievalSnapshot import SNAPSHOT_DIR, build_snapshot, collection_digest, read_manifest
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def prepare_snapshot(snapshot_dir: str, rebuild: bool = False) -> str:
+    """Make sure an up-to-date snapshot exists and return its absolute path."""
+    manifest = read_manifest(snapshot_dir)
+    collection = startup.get_collection()
+    if rebuild or not manifest or manifest.get("digest") != collection_digest(collection):
+        build_snapshot(collection, snapshot_dir)
+    else:
+        logging.info(f"Reusing retrieval snapshot in {snapshot_dir} ({manifest['count']} chunks)")
+    return os.path.abspath(snapshot_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the backend with several worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR)
+    parser.add_argument("--rebuild-snapshot", action="store_true")
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="Seconds a worker may spend finishing in-flight requests on shutdown/restart")
+    parser.add_argument("--max-requests", type=int, default=None,
+                        help="Recycle a worker after this many requests")
+    args = parser.parse_args()
+
+    # Workers inherit the environment, so they load the snapshot instead of opening Chroma
+    os.environ["RETRIEVAL_SNAPSHOT"] = prepare_snapshot(args.snapshot_dir, args.rebuild_snapshot)
+    # Each worker's upstream scheduler takes an equal share of the server's part of the API quota
+    os.environ["UPSTREAM_WORKERS"] = str(args.workers)
+
+    uvicorn.run(
+        "main:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        limit_max_requests=args.max_requests,
+    )
+
+
+if __name__ == "__main__":
+    main()
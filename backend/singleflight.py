@@ -0,0 +1,92 @@
+"""
+Coalesce identical in-flight requests into one upstream call.
+
+    answer = await chat_flight.do(fingerprint(query, language), run_pipeline, query, language)
+
+The first caller for a key starts the work as its own task; concurrent
+callers with the same key await that task and get the same result or
+exception. The task is shielded from any single caller going away and is
+only cancelled when every caller waiting on it has disconnected. Work that
+runs in the threadpool keeps running to completion in its thread; only
+the await is abandoned.
+"""
+import re
+import json
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict
+
+from tracing import Counter
+
+coalesced_total = Counter("petoai_singleflight_total",
+                          "Requests that started upstream work (leader) or joined in-flight work (shared)",
+                          ["flight", "role"])
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip().casefold()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable key for a request: whitespace/case-insensitive strings, order-insensitive dict keys."""
+    normalized = json.dumps(_normalize(list(parts)), sort_keys=True, default=str)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _consume_result(task: asyncio.Task) -> None:
+    # Mark the exception as retrieved when every caller disconnected before it finished
+    if not task.cancelled():
+        task.exception()
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def do(self, key: str, fn: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            task.add_done_callback(_consume_result)
+            task.add_done_callback(lambda t, key=key: self._forget(key, t))
+            self._tasks[key] = task
+            self._waiters[key] = 0
+            coalesced_total.inc(flight=self.name, role="leader")
+        else:
+            coalesced_total.inc(flight=self.name, role="shared")
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # This caller went away; stop the upstream work only if nobody else is waiting
+            if not task.done() and self._waiters.get(key) == 1 and self._tasks.get(key) is task:
+                # Forget the key now, not when the task finishes cancelling, so a new
+                # identical request starts fresh work instead of joining the dying task
+                self._forget(key, task)
+                task.cancel()
+            raise
+        finally:
+            if key in self._waiters and self._tasks.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+            self._waiters.pop(key, None)
+
+
+chat_flight = SingleFlight("generate_answer")
+vision_flight = SingleFlight("analyze_image")
+diet_flight = SingleFlight("generate_diet_plan")
@@ -0,0 +1,199 @@
+"""
+Shared backend resources, created once per process on first use.
+
+Heavy dependencies (chromadb, langchain, google.generativeai) are imported
+inside the factories below, so importing the API modules stays cheap. The
+FastAPI lifespan in main.py calls warm_up() to build them in parallel before
+the server accepts traffic, and the timing breakdown is exposed at /startup.
+
+Settings come from the environment or backend/.env. This module loads .env
+on import, and main.py imports it before anything that reads settings.
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Point the Gemini SDK/REST calls somewhere else, e.g. the fake servers in benchmarks/
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+CHROMA_PATH = os.getenv("CHROMA_PATH", "chroma_rag_data")
+COLLECTION_NAME = "pet_chunks"
+EMBEDDING_MODEL = "models/embedding-001"
+
+# Comma-separated component names to build during startup; "none" keeps everything lazy
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "all")
+
+
+class LazyResource:
+    """Builds a value with `factory` on first get() and records how long it took."""
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self.value: Any = None
+        self.ready = False
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        if self.ready:
+            return self.value
+        with self._lock:
+            if not self.ready:
+                started = time.perf_counter()
+                try:
+                    self.value = self.factory()
+                except Exception as e:
+                    self.error = str(e)
+                    logging.error(f"Failed to initialize {self.name}: {str(e)}")
+                    raise
+                self.seconds = time.perf_counter() - started
+                self.error = None
+                self.ready = True
+                logging.info(f"Initialized {self.name} in {self.seconds * 1000:.1f} ms")
+        return self.value
+
+
+def require_api_key() -> str:
+    """The Gemini API key; raises if it is not configured rather than calling Gemini without one."""
+    if not GEMINI_API_KEY:
+        raise RuntimeError("GEMINI_API_KEY is not set; add it to the environment or backend/.env")
+    return GEMINI_API_KEY
+
+
+def _load_genai():
+    import google.generativeai as genai
+    if GEMINI_API_ENDPOINT:
+        genai.configure(api_key=require_api_key(), transport="rest",
+                        client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+    else:
+        genai.configure(api_key=require_api_key())
+    return genai
+
+
+def _load_chroma_client():
+    import chromadb
+    return chromadb.PersistentClient(path=CHROMA_PATH)
+
+
+def _load_collection():
+    import chromadb
+    chroma_client = resources["chroma_client"].get()
+    try:
+        return chroma_client.get_collection(name=COLLECTION_NAME)
+    except (ValueError, chromadb.errors.InvalidCollectionException):
+        return chroma_client.create_collection(name=COLLECTION_NAME)
+
+
+def _load_retriever():
+    # Workers started by serve.py share one memory-mapped snapshot instead of their own Chroma handles
+    snapshot_dir = os.getenv("RETRIEVAL_SNAPSHOT")
+    if snapshot_dir:
+        from retrievalSnapshot import RetrievalSnapshot
+        return RetrievalSnapshot(snapshot_dir)
+    return resources["pet_chunks"].get()
+
+
+def _load_embeddings():
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    if GEMINI_API_ENDPOINT:
+        return GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=require_api_key(), transport="rest",
+                                            client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+    return GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=require_api_key())
+
+
+resources: Dict[str, LazyResource] = {
+    name: LazyResource(name, factory)
+    for name, factory in [
+        ("genai", _load_genai),
+        ("chroma_client", _load_chroma_client),
+        ("pet_chunks", _load_collection),
+        ("embeddings", _load_embeddings),
+        ("retriever", _load_retriever),
+    ]
+}
+
+
+def get_genai():
+    """The google.generativeai module, configured with the API key."""
+    return resources["genai"].get()
+
+
+def get_collection():
+    """The shared `pet_chunks` Chroma collection."""
+    return resources["pet_chunks"].get()
+
+
+def get_retriever():
+    """What chat retrieval queries: the snapshot in multi-worker mode, else the collection."""
+    return resources["retriever"].get()
+
+
+def get_embeddings():
+    """The shared Gemini embedding function."""
+    return resources["embeddings"].get()
+
+
+def warmup_names(setting: str = STARTUP_WARMUP) -> List[str]:
+    """Resolve a STARTUP_WARMUP value to component names, skipping (and logging) unknown ones."""
+    setting = setting.strip().lower()
+    if setting == "none":
+        return []
+    if setting == "all":
+        names = list(resources)
+        if os.getenv("RETRIEVAL_SNAPSHOT"):
+            # The snapshot replaces the Chroma handles, so don't open them per worker
+            names = [n for n in names if n not in ("chroma_client", "pet_chunks")]
+        return names
+
+    names = []
+    for name in (n.strip() for n in setting.split(",")):
+        if not name:
+            continue
+        if name in resources:
+            names.append(name)
+        else:
+            logging.warning(f"Ignoring unknown STARTUP_WARMUP component '{name}'; "
+                            f"expected one of {', '.join(resources)}, 'all' or 'none'")
+    return names
+
+
+def warm_up(names: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """Build the requested components concurrently and return the startup report."""
+    names = warmup_names() if names is None else [n for n in names if n in resources]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(len(names), 1)) as pool:
+        futures = [pool.submit(resources[name].get) for name in names]
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                pass  # Recorded on the resource; it will be retried on first use
+
+    report = startup_report()
+    report["warm_up_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logging.info(f"Startup finished in {report['warm_up_ms']} ms: {report['components']}")
+    return report
+
+
+def startup_report() -> Dict[str, Any]:
+    """Per-component initialization timings (ms) and errors."""
+    return {
+        "components": {
+            name: {
+                "ready": res.ready,
+                "ms": round(res.seconds * 1000, 1) if res.seconds is not None else None,
+                **({"error": res.error} if res.error else {}),
+            }
+            for name, res in resources.items()
+        }
+    }
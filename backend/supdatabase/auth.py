@@ -1,28 +1,44 @@
+import os
+import logging
 from fastapi import APIRouter, HTTPException
-from database.supabase_client import supabase
-from database.models import UserSignup
+from supabase import AuthApiError, PostgrestAPIError
+from supdatabase.supabase_client import get_supabase, user_auth_client
+from supdatabase.models import UserSignup
+from supdatabase.cache import TTLCache
+from tracing import record_cache
 from typing import Dict
 
 auth_router = APIRouter()
 
+# Users already known to be verified, so login skips the `users` lookup
+verified_users = TTLCache(ttl_seconds=int(os.getenv("VERIFIED_USER_CACHE_TTL", "300")), max_size=10000)
+
+
+def is_verified_claim(auth_user) -> bool:
+    """Read the verification flag mirrored into the user's app_metadata (part of the session JWT claims)."""
+    app_metadata = getattr(auth_user, "app_metadata", None) or {}
+    return bool(app_metadata.get("is_verified"))
+
+
 @auth_router.post("/signup")
 async def signup(user: UserSignup):
     """Registers a user and sends a verification email."""
-    
-    # Step 1: Sign up user with Supabase Auth
-    auth_response = supabase.auth.sign_up({
-        "email": user.email,
-        "password": user.password
-    })
+    supabase = await get_supabase()
 
-    if "error" in auth_response and auth_response["error"]:
-        raise HTTPException(status_code=400, detail=auth_response["error"]["message"])
+    # Step 1: Sign up user with Supabase Auth (never on the shared service client)
+    try:
+        auth_response = await user_auth_client().sign_up({
+            "email": user.email,
+            "password": user.password
+        })
+    except AuthApiError as e:
+        raise HTTPException(status_code=400, detail=e.message)
 
-    user_data = auth_response["user"]
+    user_data = auth_response.user
 
     # Step 2: Store user in database with verification pending
-    response = supabase.table("users").insert({
-        "id": user_data["id"],
+    await supabase.table("users").insert({
+        "id": user_data.id,
         "email": user.email,
         "full_name": user.full_name,
         "is_verified": False  # Initially False until email is confirmed
@@ -33,32 +49,56 @@ async def signup(user: UserSignup):
 @auth_router.get("/verify-email/{user_id}")
 async def verify_email(user_id: str):
     """Marks the user as verified once email confirmation is clicked."""
-    response = supabase.table("users").update({"is_verified": True}).eq("id", user_id).execute()
+    supabase = await get_supabase()
 
-    if response.data:
-        return {"message": "Email verified successfully. You can now log in."}
-    else:
+    # The `users` table is the source of truth, so it is updated first
+    try:
+        response = await supabase.table("users").update({"is_verified": True}).eq("id", user_id).execute()
+    except PostgrestAPIError as e:
+        raise HTTPException(status_code=400, detail=e.message or "Invalid user id.")
+
+    if not response.data:
         raise HTTPException(status_code=400, detail="User not found or already verified.")
 
+    # Mirror the flag into the auth claims so login can skip the table lookup
+    try:
+        await supabase.auth.admin.update_user_by_id(user_id, {"app_metadata": {"is_verified": True}})
+    except AuthApiError as e:
+        if e.status == 404:
+            raise HTTPException(status_code=404, detail="User not found.")
+        # Login falls back to the `users` table, so the user is still verified
+        logging.warning(f"Could not mirror verification claim for user {user_id}: {e.message}")
+
+    verified_users.set(user_id, True)
+    return {"message": "Email verified successfully. You can now log in."}
+
 
 @auth_router.post("/login")
 async def login(user: Dict[str, str]):
     """Logs in a user only if their email is verified."""
-    
-    auth_response = supabase.auth.sign_in_with_password({
-        "email": user["email"],
-        "password": user["password"]
-    })
+    supabase = await get_supabase()
+
+    # A separate auth client, so the shared client keeps its service-role token
+    try:
+        auth_response = await user_auth_client().sign_in_with_password({
+            "email": user["email"],
+            "password": user["password"]
+        })
+    except AuthApiError as e:
+        raise HTTPException(status_code=400, detail=e.message)
 
-    if "error" in auth_response and auth_response["error"]:
-        raise HTTPException(status_code=400, detail=auth_response["error"]["message"])
+    auth_user = auth_response.user
 
-    user_id = auth_response["user"]["id"]
+    # Verification comes from the session claims or the cache; only users verified
+    # before the claim was mirrored still need the `users` lookup
+    verified = is_verified_claim(auth_user) or verified_users.get(auth_user.id)
+    record_cache("verified_user", hit=bool(verified))
+    if not verified:
+        user_data = await supabase.table("users").select("is_verified").eq("id", auth_user.id).execute()
 
-    # Check if the user is verified
-    user_data = supabase.table("users").select("is_verified").eq("id", user_id).execute()
+        if not user_data.data or not user_data.data[0]["is_verified"]:
+            raise HTTPException(status_code=403, detail="Email not verified. Please check your inbox.")
 
-    if not user_data.data[0]["is_verified"]:
-        raise HTTPException(status_code=403, detail="Email not verified. Please check your inbox.")
+        verified_users.set(auth_user.id, True)
 
-    return {"message": "Login successful", "session": auth_response["session"]}
+    return {"message": "Login successful", "session": auth_response.session}
@@ -0,0 +1,196 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import re
+import shutil
+import tempfile
+from typing import Optional, Tuple
+
+from PIL import Image
+from storage3.utils import StorageException
+
+from supdatabase.supabase_client import get_supabase
+
+PHOTO_STORE = os.getenv("PHOTO_STORE", "supabase")
+PHOTO_STORE_PATH = os.getenv("PHOTO_STORE_PATH", "./blob_store")
+PHOTO_BUCKET = os.getenv("PHOTO_BUCKET", "pet-photos")
+
+THUMBNAIL_SIZE = (256, 256)
+# Base64 is decoded in multiples of 4 characters so each chunk is self-contained
+DECODE_CHUNK_CHARS = 64 * 1024
+DATA_URL_PATTERN = re.compile(r"^data:(?P<mime>[\w.+-]+/[\w.+-]+)?(;[\w-]+=[\w-]+)*;base64,")
+
+
+def split_data_url(data_url: str) -> Tuple[str, str]:
+    """Split a `data:<mime>;base64,<payload>` URL into (mime_type, payload)."""
+    match = DATA_URL_PATTERN.match(data_url)
+    if not match:
+        raise ValueError("Photo must be a base64 data URL")
+    return match.group("mime") or "application/octet-stream", data_url[match.end():]
+
+
+def blob_path(key: str, thumbnail: bool = False) -> str:
+    """Relative storage path for a blob key, fanned out by the first two hex digits."""
+    if not re.fullmatch(r"[0-9a-f]{64}", key):
+        raise ValueError("Invalid blob key")
+    folder = "thumbs" if thumbnail else "objects"
+    return f"{folder}/{key[:2]}/{key}"
+
+
+def _spool_base64(payload: str) -> Tuple[str, tempfile.SpooledTemporaryFile]:
+    """Decode base64 chunk by chunk into a spooled temp file, hashing as it goes."""
+    digest = hashlib.sha256()
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    try:
+        for start in range(0, len(payload), DECODE_CHUNK_CHARS):
+            chunk = base64.b64decode(payload[start:start + DECODE_CHUNK_CHARS], validate=True)
+            digest.update(chunk)
+            spool.write(chunk)
+    except binascii.Error:
+        spool.close()
+        raise ValueError("Photo is not valid base64")
+    spool.seek(0)
+    return digest.hexdigest(), spool
+
+
+def make_thumbnail(source) -> bytes:
+    """Render a JPEG thumbnail that fits in THUMBNAIL_SIZE."""
+    with Image.open(source) as image:
+        image = image.convert("RGB")
+        image.thumbnail(THUMBNAIL_SIZE)
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=80, optimize=True)
+        return out.getvalue()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def image_mime_type(data: bytes) -> str:
+    """Sniff the MIME type of stored image bytes from their header."""
+    with Image.open(io.BytesIO(data)) as image:
+        return image.get_format_mimetype() or "application/octet-stream"
+
+
+class LocalBlobStore:
+    """Filesystem-backed content-addressed store, used for tests and local development."""
+
+    def __init__(self, root: str = PHOTO_STORE_PATH):
+        self.root = root
+
+    def _full_path(self, key: str, thumbnail: bool = False) -> str:
+        return os.path.join(self.root, blob_path(key, thumbnail))
+
+    @staticmethod
+    def _temp_file(path: str):
+        # Unique per call: identical uploads often arrive together, which is exactly when dedup matters
+        return tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=".", suffix=".tmp", delete=False)
+
+    def _put(self, key: str, spool) -> None:
+        path = self._full_path(key)
+        if os.path.exists(path):
+            return  # Same content already stored
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._temp_file(path) as f:
+            shutil.copyfileobj(spool, f)
+            tmp_path = f.name
+        try:
+            try:
+                thumbnail = make_thumbnail(tmp_path)
+            except Exception:
+                raise ValueError("Photo could not be decoded as an image")
+
+            thumb_path = self._full_path(key, thumbnail=True)
+            os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+            with self._temp_file(thumb_path) as f:
+                f.write(thumbnail)
+                thumb_tmp_path = f.name
+            os.replace(thumb_tmp_path, thumb_path)
+
+            # Publish the original last so its presence implies the thumbnail exists.
+            # If a concurrent upload of the same content got there first, this is a dedup hit.
+            if not os.path.exists(path):
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def put(self, key: str, spool, mime_type: str) -> None:
+        await asyncio.to_thread(self._put, key, spool)
+
+    async def get(self, key: str, thumbnail: bool = False) -> Optional[bytes]:
+        path = self._full_path(key, thumbnail)
+        if not os.path.exists(path):
+            return None
+        return await asyncio.to_thread(_read_file, path)
+
+
+def _is_duplicate(error: StorageException) -> bool:
+    # Storage reports the status code as a string in its error body
+    return str(getattr(error, "status", "")) == "409" or getattr(error, "code", None) == "Duplicate"
+
+
+class SupabaseBlobStore:
+    """Content-addressed store on a Supabase Storage bucket."""
+
+    def __init__(self, bucket: str = PHOTO_BUCKET):
+        self.bucket = bucket
+
+    async def put(self, key: str, spool, mime_type: str) -> None:
+        supabase = await get_supabase()
+        storage = supabase.storage.from_(self.bucket)
+        data = spool.read()
+        try:
+            thumbnail = await asyncio.to_thread(make_thumbnail, io.BytesIO(data))
+        except Exception:
+            raise ValueError("Photo could not be decoded as an image")
+
+        # Thumbnail first, original last, so the original's presence implies the thumbnail exists
+        await storage.upload(blob_path(key, thumbnail=True), thumbnail,
+                             {"content-type": "image/jpeg", "upsert": "true"})
+        try:
+            await storage.upload(blob_path(key), data, {"content-type": mime_type})
+        except StorageException as e:
+            # A conflict means the bucket already holds this content: a dedup hit
+            if not _is_duplicate(e):
+                raise
+
+    async def get(self, key: str, thumbnail: bool = False) -> Optional[bytes]:
+        supabase = await get_supabase()
+        try:
+            return await supabase.storage.from_(self.bucket).download(blob_path(key, thumbnail))
+        except StorageException:
+            return None
+
+
+_store = None
+
+
+def get_blob_store():
+    """Return the configured blob store (PHOTO_STORE=local|supabase)."""
+    global _store
+    if _store is None:
+        _store = LocalBlobStore() if PHOTO_STORE == "local" else SupabaseBlobStore()
+    return _store
+
+
+async def store_photo(data_url: Optional[str]) -> Optional[str]:
+    """Store a base64 data-URL photo and return its content hash key (None when no photo)."""
+    if not data_url:
+        return None
+    mime_type, payload = split_data_url(data_url)
+    if not mime_type.startswith("image/"):
+        raise ValueError("Photo must be an image")
+    key, spool = await asyncio.to_thread(_spool_base64, payload)
+    try:
+        await get_blob_store().put(key, spool, mime_type)
+    finally:
+        spool.close()
+    logging.info(f"Stored pet photo {key[:12]} ({mime_type})")
+    return key
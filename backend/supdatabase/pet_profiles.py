@@ -1,12 +1,27 @@
+from typing import Dict
+from fastapi import HTTPException, Response
+from supdatabase.auth import auth_router
+from supdatabase.blob_store import get_blob_store, image_mime_type, store_photo
+from supdatabase.profile_service import profile_service
+from supdatabase.supabase_client import get_supabase
+
+
 @auth_router.post("/petprofilesetup")
 async def store_pet_profile(profile_data: Dict):
     """Stores pet profile data for the authenticated user."""
-    
+    supabase = await get_supabase()
+
     user_id = profile_data["user_id"]  # Get user_id from frontend
 
-    response = supabase.table("pet_profiles").insert({
+    # The photo goes to the blob store; the row only keeps its content key
+    try:
+        photo_key = await store_photo(profile_data.get("photo"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    response = await supabase.table("pet_profiles").insert({
         "user_id": user_id,
-        "photo": profile_data["photo"],
+        "photo": photo_key,
         "name": profile_data["name"],
         "species": profile_data["species"],
         "breed": profile_data["breed"],
@@ -20,4 +35,31 @@ async def store_pet_profile(profile_data: Dict):
         "notes": profile_data["notes"]
     }).execute()
 
-    return {"message": "Pet profile saved successfully."}
+    profile_service.invalidate_user(user_id)
+
+    return {"message": "Pet profile saved successfully.", "photo": photo_key}
+
+
+@auth_router.get("/petprofiles/{user_id}")
+async def list_pet_profiles(user_id: str):
+    """Lists a user's pet profiles (photo fields are blob keys)."""
+    return {"profiles": await profile_service.list_for_user(user_id)}
+
+
+@auth_router.get("/pet-photos/{key}")
+async def get_pet_photo(key: str, thumbnail: bool = False):
+    """Serves a stored pet photo (or its thumbnail) by blob key."""
+    try:
+        data = await get_blob_store().get(key, thumbnail=thumbnail)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if data is None:
+        raise HTTPException(status_code=404, detail="Photo not found.")
+
+    # Blobs are immutable, so clients may cache them indefinitely
+    return Response(
+        content=data,
+        media_type=image_mime_type(data),
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
@@ -0,0 +1,115 @@
+import os
+from typing import Dict, Iterable, List, Optional
+from supdatabase.cache import TTLCache
+from supdatabase.supabase_client import get_supabase
+from tracing import record_cache
+
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "300"))
+LB_TO_KG = 0.45359237
+
+
+class PetProfileService:
+    """
+    Read-through cache over the `pet_profiles` table.
+
+    Profiles are cached by id and each user's pet ids by user id. Writes for a
+    user invalidate both, so the next read goes back to Supabase. The cache is
+    per process; the TTL bounds staleness across workers.
+    """
+
+    def __init__(self, ttl_seconds: int = PROFILE_CACHE_TTL):
+        self._profiles = TTLCache(ttl_seconds=ttl_seconds, max_size=10000)
+        self._user_pets = TTLCache(ttl_seconds=ttl_seconds, max_size=10000)
+
+    def _remember(self, rows: Iterable[Dict]) -> None:
+        for row in rows:
+            self._profiles.set(str(row["id"]), row)
+
+    async def get(self, pet_id: str) -> Optional[Dict]:
+        return (await self.get_many([pet_id])).get(str(pet_id))
+
+    async def get_owned(self, pet_id: str, user_id: str) -> Optional[Dict]:
+        """Return the profile only if it belongs to `user_id`, so one user can't read another's pet."""
+        row = await self.get(pet_id)
+        if row is None or str(row.get("user_id")) != str(user_id):
+            return None
+        return row
+
+    async def get_many(self, pet_ids: Iterable[str]) -> Dict[str, Dict]:
+        """Return {pet_id: row}, fetching every cache miss in a single `IN` query."""
+        found, missing = {}, []
+        for pet_id in dict.fromkeys(str(p) for p in pet_ids):
+            row = self._profiles.get(pet_id)
+            if row is None:
+                missing.append(pet_id)
+            else:
+                found[pet_id] = row
+        record_cache("pet_profile", hit=True, count=len(found))
+        record_cache("pet_profile", hit=False, count=len(missing))
+
+        if missing:
+            supabase = await get_supabase()
+            response = await supabase.table("pet_profiles").select("*").in_("id", missing).execute()
+            self._remember(response.data)
+            found.update({str(row["id"]): row for row in response.data})
+
+        return found
+
+    async def list_for_user(self, user_id: str) -> List[Dict]:
+        pet_ids = self._user_pets.get(user_id)
+        record_cache("user_pets", hit=pet_ids is not None)
+        if pet_ids is not None:
+            profiles = await self.get_many(pet_ids)
+            return [profiles[p] for p in pet_ids if p in profiles]
+
+        supabase = await get_supabase()
+        response = await supabase.table("pet_profiles").select("*").eq("user_id", user_id).execute()
+        self._remember(response.data)
+        self._user_pets.set(user_id, [str(row["id"]) for row in response.data])
+        return response.data
+
+    def invalidate_user(self, user_id: str) -> None:
+        """Drop everything cached for a user; call after any write to their profiles."""
+        self._user_pets.delete(user_id)
+        self._profiles.delete_where(lambda _, row: str(row.get("user_id")) == str(user_id))
+
+
+def _as_list(value) -> List[str]:
+    """Accept either a list or the comma-joined string the profile form stores."""
+    if not value:
+        return []
+    items = value.split(",") if isinstance(value, str) else value
+    return [item.strip() for item in map(str, items) if item.strip()]
+
+
+def to_diet_profile(row: Dict) -> Dict:
+    """Map a `pet_profiles` row to the pet_info fields used by the diet planner."""
+    weight = float(row.get("weight") or 0)
+    if row.get("weight_unit") == "lb":
+        weight *= LB_TO_KG
+
+    return {
+        "name": row.get("name", ""),
+        "age": f"{row.get('age', '')} {row.get('age_unit', '')}".strip(),
+        "breed": row.get("breed", ""),
+        "weight": f"{weight:.2f}",
+        "activityLevel": (row.get("activity_level") or "medium").capitalize(),
+        "healthConditions": _as_list(row.get("health_conditions")),
+        "foodTypes": _as_list(row.get("dietary_preferences")),
+        "allergens": [],
+        "customRestrictions": row.get("notes") or "None",
+    }
+
+
+def describe_pet(row: Dict) -> str:
+    """Short plain-text summary of a pet used to personalize chat answers."""
+    info = to_diet_profile(row)
+    conditions = ", ".join(info["healthConditions"]) or "None"
+    return (
+        f"{info['name']} is a {row.get('species') or 'pet'} ({info['breed']}), "
+        f"aged {info['age']}, weighing {info['weight']} kg, activity level {info['activityLevel']}. "
+        f"Health conditions: {conditions}."
+    )
+
+
+profile_service = PetProfileService()
@@ -1,10 +1,84 @@
-from supabase import create_client, Client
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+from supabase_auth import AsyncGoTrueClient
+import asyncio
+import logging
 import os
+import httpx
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+SUPABASE_TIMEOUT = int(os.getenv("SUPABASE_TIMEOUT", "10"))
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# One async client per process; its HTTP sessions keep connections alive and pooled.
+# It must stay on the service-role key: it serves table, storage and admin calls only.
+_client: Optional[AsyncClient] = None
+_client_lock = asyncio.Lock()
+# Connection pool for the per-request user auth clients below
+_user_auth_http: Optional[httpx.AsyncClient] = None
+
+
+async def get_supabase() -> AsyncClient:
+    """Return the shared async Supabase client, creating it on first use."""
+    global _client
+    if _client is None:
+        async with _client_lock:
+            if _client is None:
+                _client = await acreate_client(
+                    SUPABASE_URL,
+                    SUPABASE_KEY,
+                    options=AsyncClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT),
+                )
+    return _client
+
+
+def user_auth_client() -> AsyncGoTrueClient:
+    """A short-lived auth client for signing users up or in.
+
+    Signing in on the shared client would fire its SIGNED_IN listener, which
+    switches postgrest, storage and the admin API to the user's token. This
+    client keeps no session and is discarded after the call; only its
+    connection pool is shared.
+    """
+    global _user_auth_http
+    if _user_auth_http is None:
+        _user_auth_http = httpx.AsyncClient(timeout=SUPABASE_TIMEOUT, follow_redirects=True)
+    return AsyncGoTrueClient(
+        url=f"{SUPABASE_URL}/auth/v1",
+        headers={"apiKey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"},
+        auto_refresh_token=False,
+        persist_session=False,
+        http_client=_user_auth_http,
+    )
+
+
+async def _close_http(component) -> None:
+    """Close the httpx client behind one Supabase sub-client (auth, postgrest, storage, functions)."""
+    for attr in ("session", "_http_client", "_client"):
+        http = getattr(component, attr, None)
+        if isinstance(http, httpx.AsyncClient):
+            await http.aclose()
+            return
+
+
+async def close_supabase() -> None:
+    """Close the pooled connections and drop the shared client (called on app shutdown)."""
+    global _client, _user_auth_http
+    if _user_auth_http is not None:
+        await _user_auth_http.aclose()
+        _user_auth_http = None
+    if _client is None:
+        return
+    client, _client = _client, None
+    # postgrest, storage and functions are created on first use; only close the ones that exist
+    components = [client.auth] + [getattr(client, name, None) for name in ("_postgrest", "_storage", "_functions")]
+    for component in components:
+        if component is None:
+            continue
+        try:
+            await _close_http(component)
+        except Exception as e:
+            logging.warning(f"Error closing Supabase {type(component).__name__}: {str(e)}")
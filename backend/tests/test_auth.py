@@ -0,0 +1,57 @@
+import json
+import asyncio
+
+import httpx
+from supabase import acreate_client
+
+from supdatabase import auth, supabase_client
+
+SUPABASE_URL = "http://supabase.test"
+SERVICE_KEY = "service-role-key"
+USER_ID = "0b6f9c3e-2c1d-4d5e-9f00-000000000001"
+
+
+def token_response(request: httpx.Request) -> httpx.Response:
+    assert request.url.path == "/auth/v1/token"
+    return httpx.Response(200, json={
+        "access_token": "USER-JWT",
+        "refresh_token": "refresh",
+        "token_type": "bearer",
+        "expires_in": 3600,
+        "expires_at": 4102444800,
+        "user": {
+            "id": USER_ID,
+            "aud": "authenticated",
+            "email": json.loads(request.content)["email"],
+            "app_metadata": {"is_verified": True},
+            "user_metadata": {},
+            "created_at": "2024-01-01T00:00:00Z",
+        },
+    })
+
+
+def test_login_leaves_the_shared_service_client_on_the_service_key(monkeypatch):
+    async def scenario():
+        monkeypatch.setattr(supabase_client, "SUPABASE_URL", SUPABASE_URL)
+        monkeypatch.setattr(supabase_client, "SUPABASE_KEY", SERVICE_KEY)
+        monkeypatch.setattr(supabase_client, "_user_auth_http",
+                            httpx.AsyncClient(transport=httpx.MockTransport(token_response)))
+        shared = await acreate_client(SUPABASE_URL, SERVICE_KEY)
+        monkeypatch.setattr(supabase_client, "_client", shared)
+
+        service_header = f"Bearer {SERVICE_KEY}"
+        postgrest_session = shared.postgrest.session
+        assert postgrest_session.headers["Authorization"] == service_header
+
+        result = await auth.login({"email": "owner@example.com", "password": "secret"})
+        await asyncio.sleep(0)  # Let any auth-event callbacks run
+
+        assert result["session"].access_token == "USER-JWT"
+        assert shared.auth._headers["Authorization"] == service_header
+        assert shared.options.headers["Authorization"] == service_header
+        assert shared.postgrest.session is postgrest_session
+        assert shared.postgrest.session.headers["Authorization"] == service_header
+
+        await supabase_client.close_supabase()
+
+    asyncio.run(scenario())
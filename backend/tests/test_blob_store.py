@@ -0,0 +1,88 @@
+import io
+import os
+import asyncio
+import hashlib
+import threading
+
+import pytest
+from PIL import Image
+
+from supdatabase.blob_store import LocalBlobStore, blob_path
+
+
+def png_bytes(color=(200, 120, 40), size=(640, 480)) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", size, color).save(out, format="PNG")
+    return out.getvalue()
+
+
+def put(store, data: bytes) -> str:
+    key = hashlib.sha256(data).hexdigest()
+    asyncio.run(store.put(key, io.BytesIO(data), "image/png"))
+    return key
+
+
+def stored_files(root):
+    return sorted(os.path.relpath(os.path.join(folder, name), root)
+                  for folder, _, names in os.walk(root) for name in names)
+
+
+def test_put_stores_the_original_and_a_thumbnail(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    data = png_bytes()
+    key = put(store, data)
+
+    assert asyncio.run(store.get(key)) == data
+    with Image.open(io.BytesIO(asyncio.run(store.get(key, thumbnail=True)))) as thumbnail:
+        assert thumbnail.format == "JPEG"
+        assert max(thumbnail.size) <= 256
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    data = png_bytes()
+    key = put(store, data)
+    assert put(store, data) == key
+    assert stored_files(tmp_path) == [blob_path(key), blob_path(key, thumbnail=True)]
+
+
+def test_concurrent_uploads_of_the_same_image_all_succeed(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    data = png_bytes()
+    key = hashlib.sha256(data).hexdigest()
+    start = threading.Barrier(8)
+    errors = []
+
+    def upload():
+        start.wait()
+        try:
+            store._put(key, io.BytesIO(data))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=upload) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert errors == []
+    assert asyncio.run(store.get(key)) == data
+    # No temp files left behind by the losers
+    assert stored_files(tmp_path) == [blob_path(key), blob_path(key, thumbnail=True)]
+
+
+def test_non_images_are_rejected_without_storing_anything(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        put(store, b"not an image")
+    assert stored_files(tmp_path) == []
+
+
+@pytest.mark.parametrize("key", ["../../etc/passwd", "ABCDEF" * 10 + "ABCD", "0" * 63, ""])
+def test_invalid_keys_are_rejected(tmp_path, key):
+    store = LocalBlobStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        asyncio.run(store.put(key, io.BytesIO(png_bytes()), "image/png"))
+    with pytest.raises(ValueError):
+        asyncio.run(store.get(key))
@@ -0,0 +1,28 @@
+from supdatabase.profile_service import describe_pet, to_diet_profile
+
+ROW = {
+    "name": "Biscuit",
+    "species": "dog",
+    "breed": "Beagle",
+    "age": 4,
+    "age_unit": "years",
+    "weight": 22,
+    "weight_unit": "lb",
+    "activity_level": "high",
+}
+
+
+def test_comma_joined_strings_from_the_profile_form_become_lists():
+    profile = to_diet_profile({**ROW, "health_conditions": "Joint Issues, Allergies,",
+                               "dietary_preferences": "Dry Food,Wet Food"})
+    assert profile["healthConditions"] == ["Joint Issues", "Allergies"]
+    assert profile["foodTypes"] == ["Dry Food", "Wet Food"]
+    assert "Health conditions: Joint Issues, Allergies." in describe_pet({**ROW, "health_conditions": "Joint Issues, Allergies"})
+
+
+def test_list_and_missing_values_are_accepted():
+    profile = to_diet_profile({**ROW, "health_conditions": [" Diabetes "], "dietary_preferences": None})
+    assert profile["healthConditions"] == ["Diabetes"]
+    assert profile["foodTypes"] == []
+    assert profile["weight"] == "9.98"
+    assert describe_pet(ROW).endswith("Health conditions: None.")
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta, timezone
+
+from promptRegistry import (
+    MIN_CACHE_TOKENS,
+    GeminiPromptBackend,
+    LocalModel,
+    LocalPromptBackend,
+    PromptRegistry,
+)
+
+
+class ExpiringCacheBackend:
+    """Pretends every prefix got an upstream context cache that lives for an hour."""
+
+    def __init__(self):
+        self.builds = 0
+
+    def model(self, handle):
+        self.builds += 1
+        handle.cached_content_name = f"cachedContents/{self.builds}"
+        handle.expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+        return f"model-{self.builds}"
+
+    def rest_fields(self, handle):
+        return {"cachedContent": handle.cached_content_name}
+
+
+def test_registering_the_same_text_returns_the_same_handle():
+    registry = PromptRegistry(backend=LocalPromptBackend())
+    first = registry.register("rag", "You are a pet assistant.", "gemini-1.5-flash")
+    again = registry.register("rag", "  You are a pet assistant.\n", "gemini-1.5-flash")
+    assert again is first
+
+    changed = registry.register("rag", "You are a vet.", "gemini-1.5-flash")
+    assert changed is not first
+    assert changed.digest != first.digest
+    assert registry.get("rag") is changed
+
+
+def test_models_are_reused_per_prefix():
+    registry = PromptRegistry(backend=LocalPromptBackend())
+    registry.register("refine", "Refine the query.", "gemini-1.5-flash")
+    registry.register("answer", "Answer the query.", "gemini-1.5-flash")
+
+    model = registry.model("refine")
+    assert isinstance(model, LocalModel)
+    assert registry.model("refine") is model
+    assert registry.model("answer") is not model
+
+
+def test_changing_the_text_drops_the_built_model():
+    backend = ExpiringCacheBackend()
+    registry = PromptRegistry(backend=backend)
+    registry.register("rag", "Old instructions.", "gemini-1.5-flash")
+    registry.model("rag")
+    registry.register("rag", "New instructions.", "gemini-1.5-flash")
+    assert registry.model("rag") == "model-2"
+
+
+def test_model_is_rebuilt_when_its_context_cache_expires():
+    backend = ExpiringCacheBackend()
+    registry = PromptRegistry(backend=backend)
+    handle = registry.register("rag", "Instructions.", "gemini-1.5-flash")
+
+    assert registry.model("rag") == "model-1"
+    assert registry.model("rag") == "model-1"
+    assert backend.builds == 1
+
+    handle.expires_at = datetime.now(timezone.utc)  # Inside the refresh margin
+    assert not handle.is_cached
+    assert registry.model("rag") == "model-2"
+    assert backend.builds == 2
+
+
+def test_use_backend_clears_built_models_and_cache_state():
+    registry = PromptRegistry(backend=ExpiringCacheBackend())
+    handle = registry.register("rag", "Instructions.", "gemini-1.5-flash")
+    registry.model("rag")
+    assert handle.cached_content_name is not None
+
+    local = LocalPromptBackend()
+    registry.use_backend(local)
+    assert handle.cached_content_name is None
+    assert handle.expires_at is None
+    assert registry.model("rag") is local.models["rag"]
+
+
+def test_short_prefixes_are_sent_as_system_instructions():
+    registry = PromptRegistry(backend=GeminiPromptBackend())
+    handle = registry.register("diet", "Plan a diet.", "gemini-1.5-flash")
+    assert len(handle.text) // 4 < MIN_CACHE_TOKENS
+
+    assert registry.rest_fields("diet") == {"systemInstruction": {"parts": [{"text": "Plan a diet."}]}}
+    assert handle.cached_content_name is None
+
+
+def test_long_prefixes_use_a_context_cache(monkeypatch):
+    backend = GeminiPromptBackend(min_cache_tokens=1)
+    created = []
+
+    def create_cache(handle):
+        created.append(handle.name)
+        handle.cached_content_name = "cachedContents/abc"
+        handle.expires_at = datetime.now(timezone.utc) + backend.ttl
+
+    monkeypatch.setattr(backend, "_create_cache", create_cache)
+    registry = PromptRegistry(backend=backend)
+    registry.register("diet", "Plan a diet for the pet described below.", "gemini-1.5-flash")
+
+    assert registry.rest_fields("diet") == {"cachedContent": "cachedContents/abc"}
+    assert registry.rest_fields("diet") == {"cachedContent": "cachedContents/abc"}
+    assert created == ["diet"]
+
+
+def test_local_backend_rest_fields_are_valid_for_the_real_endpoint():
+    registry = PromptRegistry(backend=LocalPromptBackend())
+    registry.register("diet", "Plan a diet.", "gemini-1.5-flash")
+    assert "cachedContent" not in registry.rest_fields("diet")
+    assert registry.rest_fields("diet")["systemInstruction"]["parts"][0]["text"] == "Plan a diet."
@@ -0,0 +1,47 @@
+import numpy as np
+
+from retrievalSnapshot import RetrievalSnapshot, build_snapshot, read_manifest
+
+
+class FakeCollection:
+    name = "pet_chunks"
+    metadata = {"hnsw:space": "l2"}
+
+    def __init__(self, ids, documents, embeddings):
+        self.ids, self.documents, self.embeddings = ids, documents, embeddings
+
+    def count(self):
+        return len(self.ids)
+
+    def get(self, include):
+        data = {"ids": list(self.ids), "documents": list(self.documents)}
+        if "embeddings" in include:
+            data["embeddings"] = np.array(self.embeddings, dtype=np.float32)
+        return data
+
+
+def test_empty_collection_builds_an_empty_snapshot(tmp_path):
+    out_dir = str(tmp_path / "snapshot")
+    manifest = build_snapshot(FakeCollection([], [], []), out_dir)
+    assert manifest["count"] == 0
+    assert manifest["dimension"] == 0
+
+    snapshot = RetrievalSnapshot(out_dir)
+    assert snapshot.query([[0.1, 0.2]], n_results=3) == {"ids": [[]], "documents": [[]], "distances": [[]]}
+
+
+def test_query_returns_nearest_passages(tmp_path):
+    out_dir = str(tmp_path / "snapshot")
+    build_snapshot(FakeCollection(["a", "b", "c"], ["cats", "dogs", "fish"],
+                                  [[1, 0], [0, 1], [-1, 0]]), out_dir)
+    result = RetrievalSnapshot(out_dir).query([[0.9, 0.1]], n_results=2)
+    assert result["ids"] == [["a", "b"]]
+    assert result["documents"] == [["cats", "dogs"]]
+
+
+def test_digest_changes_when_a_passage_changes_at_the_same_count(tmp_path):
+    out_dir = str(tmp_path / "snapshot")
+    build_snapshot(FakeCollection(["a", "b"], ["cats", "dogs"], [[1, 0], [0, 1]]), out_dir)
+    before = read_manifest(out_dir)["digest"]
+    build_snapshot(FakeCollection(["a", "b"], ["cats", "puppies"], [[1, 0], [0, 1]]), out_dir)
+    assert read_manifest(out_dir)["digest"] != before
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight, fingerprint
+
+
+class Upstream:
+    """Stand-in for upstream work that finishes only when the test releases it."""
+
+    def __init__(self, result="answer", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def __call__(self, *args):
+        self.calls += 1
+        self.started.set()
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        return self.result
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_identical_requests_share_one_call():
+    async def scenario():
+        flight = SingleFlight("test")
+        upstream = Upstream()
+        callers = [asyncio.ensure_future(flight.do("k", upstream)) for _ in range(3)]
+        await upstream.started.wait()
+        assert flight.in_flight() == 1
+        upstream.release.set()
+        assert await asyncio.gather(*callers) == ["answer"] * 3
+        assert upstream.calls == 1
+        assert flight.in_flight() == 0
+
+        # Results are not cached once the work has finished
+        assert await flight.do("k", upstream) == "answer"
+        assert upstream.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_different_keys_do_not_coalesce():
+    async def scenario():
+        flight = SingleFlight("test")
+        upstream = Upstream()
+        upstream.release.set()
+        assert await asyncio.gather(flight.do("a", upstream), flight.do("b", upstream)) == ["answer"] * 2
+        assert upstream.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_error_reaches_every_waiter():
+    async def scenario():
+        flight = SingleFlight("test")
+        upstream = Upstream(error=ValueError("upstream failed"))
+        callers = [asyncio.ensure_future(flight.do("k", upstream)) for _ in range(3)]
+        await upstream.started.wait()
+        upstream.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        assert upstream.calls == 1
+        assert flight.in_flight() == 0
+
+    asyncio.run(scenario())
+
+
+def test_leader_disconnect_keeps_work_running_for_others():
+    async def scenario():
+        flight = SingleFlight("test")
+        upstream = Upstream()
+        leader = asyncio.ensure_future(flight.do("k", upstream))
+        await upstream.started.wait()
+        follower = asyncio.ensure_future(flight.do("k", upstream))
+        await _settle()
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+        upstream.release.set()
+        assert await follower == "answer"
+        assert upstream.calls == 1
+        assert upstream.cancelled == 0
+
+    asyncio.run(scenario())
+
+
+def test_all_waiters_disconnecting_cancels_the_work():
+    async def scenario():
+        flight = SingleFlight("test")
+        upstream = Upstream()
+        callers = [asyncio.ensure_future(flight.do("k", upstream)) for _ in range(2)]
+        await upstream.started.wait()
+
+        for caller in callers:
+            caller.cancel()
+        for caller in callers:
+            with pytest.raises(asyncio.CancelledError):
+                await caller
+        # The key is released as soon as the last waiter leaves, before the task finishes cancelling
+        assert flight.in_flight() == 0
+
+        # A new identical request must start fresh work rather than join the dying task
+        fresh = Upstream(result="fresh")
+        fresh.release.set()
+        assert await flight.do("k", fresh) == "fresh"
+        await _settle()
+        assert upstream.cancelled == 1
+        assert flight.in_flight() == 0
+
+    asyncio.run(scenario())
+
+
+def test_fingerprint_normalizes_whitespace_case_and_key_order():
+    assert fingerprint("How  much food?", {"a": 1, "b": "X"}) == fingerprint(" how much FOOD? ", {"b": "x", "a": 1})
+    assert fingerprint("dog") != fingerprint("cat")
@@ -0,0 +1,23 @@
+import os
+
+import tracing
+
+
+def test_every_series_carries_the_worker_label():
+    tracing.request_seconds.observe(0.02, route="/chat", status="200")
+    tracing.cache_requests_total.inc(cache="pet_profile", result="hit")
+
+    worker = f'worker="{os.getpid()}"'
+    series = [line for line in tracing.render_metrics().splitlines() if line and not line.startswith("#")]
+    assert series
+    assert all(worker in line for line in series)
+    assert f'petoai_request_seconds_bucket{{{worker},route="/chat",status="200",le="0.025"}} ' in "\n".join(series)
+
+
+def test_label_values_are_escaped():
+    counter = tracing.Counter("petoai_test_total", "Test counter", ["name"])
+    try:
+        counter.inc(name='a "quoted"\nvalue')
+        assert f'petoai_test_total{{worker="{os.getpid()}",name="a \\"quoted\\"\\nvalue"}} 1' in counter.render()
+    finally:
+        tracing.METRICS.remove(counter)
@@ -0,0 +1,234 @@
+import time
+import asyncio
+import threading
+
+import anyio.to_thread
+import pytest
+
+import upstreamScheduler
+from upstreamScheduler import Priority, UpstreamOverloaded, UpstreamScheduler
+
+MODEL = "gemini-test"
+
+
+def make_scheduler(rps=1000.0, burst=1000, concurrency=1):
+    return UpstreamScheduler(limits={MODEL: {"rps": rps, "burst": burst, "concurrency": concurrency}},
+                             shared_rps=0)
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached in time")
+        time.sleep(0.005)
+
+
+class Blocker:
+    """Occupies the model's only slot until released."""
+
+    def __init__(self, scheduler):
+        self.release = threading.Event()
+        self.thread = threading.Thread(target=scheduler.call, args=(MODEL, self.release.wait))
+        self.thread.start()
+        wait_until(lambda: scheduler._queue(MODEL).running == 1)
+
+    def finish(self):
+        self.release.set()
+        self.thread.join(timeout=2)
+
+
+class RateLimited(Exception):
+    class response:
+        status_code = 429
+
+
+def queue_in_threads(scheduler, calls, order):
+    """Start one blocking call per (name, priority, deadline) and wait until all are queued."""
+    threads = []
+    for name, priority, deadline in calls:
+        thread = threading.Thread(target=scheduler.call, args=(MODEL, order.append, name),
+                                  kwargs={"priority": priority, "deadline": deadline})
+        thread.start()
+        threads.append(thread)
+        # Queue them one at a time so arrival order is fixed
+        wait_until(lambda n=len(threads): len(scheduler._queue(MODEL).waiting) == n)
+    return threads
+
+
+def test_waiting_calls_run_by_priority_then_arrival():
+    scheduler = make_scheduler()
+    blocker = Blocker(scheduler)
+    order = []
+    threads = queue_in_threads(scheduler, [
+        ("bulk", Priority.BULK, None),
+        ("standard", Priority.STANDARD, None),
+        ("interactive-1", Priority.INTERACTIVE, None),
+        ("interactive-2", Priority.INTERACTIVE, None),
+    ], order)
+
+    blocker.finish()
+    for thread in threads:
+        thread.join(timeout=2)
+    assert order == ["interactive-1", "interactive-2", "standard", "bulk"]
+
+
+def test_earlier_deadline_runs_first_within_a_class():
+    scheduler = make_scheduler()
+    # Keep admission-time shedding out of the way; only ordering is under test
+    scheduler._queue(MODEL).avg_service = 0.001
+    blocker = Blocker(scheduler)
+    order = []
+    threads = queue_in_threads(scheduler, [
+        ("no-deadline", Priority.STANDARD, None),
+        ("late", Priority.STANDARD, 60),
+        ("soon", Priority.STANDARD, 30),
+    ], order)
+
+    blocker.finish()
+    for thread in threads:
+        thread.join(timeout=2)
+    assert order == ["soon", "late", "no-deadline"]
+
+
+def test_async_and_blocking_callers_share_one_queue():
+    scheduler = make_scheduler()
+    blocker = Blocker(scheduler)
+    order = []
+
+    async def scenario():
+        bulk = threading.Thread(target=scheduler.call, args=(MODEL, order.append, "bulk-thread"),
+                                kwargs={"priority": Priority.BULK, "deadline": None})
+        bulk.start()
+        await asyncio.to_thread(wait_until, lambda: len(scheduler._queue(MODEL).waiting) == 1)
+        interactive = asyncio.ensure_future(
+            scheduler.acall(MODEL, order.append, "interactive-async", priority=Priority.INTERACTIVE, deadline=None))
+        await asyncio.to_thread(wait_until, lambda: len(scheduler._queue(MODEL).waiting) == 2)
+
+        blocker.finish()
+        await interactive
+        await asyncio.to_thread(bulk.join, 2)
+
+    asyncio.run(scenario())
+    assert order == ["interactive-async", "bulk-thread"]
+
+
+def test_call_is_shed_when_it_cannot_start_before_its_deadline():
+    scheduler = make_scheduler(rps=0.1, burst=1)
+    scheduler.call(MODEL, lambda: None)  # Uses the only token; the next one is ~10s away
+
+    calls = []
+    started = time.monotonic()
+    with pytest.raises(UpstreamOverloaded) as excinfo:
+        scheduler.call(MODEL, calls.append, "never", deadline=1)
+    assert time.monotonic() - started < 0.5  # Rejected up front, not after waiting
+    assert excinfo.value.retry_after > 1
+    assert calls == []
+    assert scheduler._queue(MODEL).waiting == []
+
+
+def test_queued_call_is_shed_when_its_deadline_passes():
+    scheduler = make_scheduler()
+    # Predict a short wait so the call is admitted to the queue
+    scheduler._queue(MODEL).avg_service = 0.001
+    blocker = Blocker(scheduler)
+
+    calls = []
+    started = time.monotonic()
+    with pytest.raises(UpstreamOverloaded):
+        scheduler.call(MODEL, calls.append, "late", deadline=0.2)
+    assert 0.15 < time.monotonic() - started < 1.0
+    assert calls == []
+    assert scheduler._queue(MODEL).waiting == []
+    blocker.finish()
+
+
+def test_rate_limited_call_pauses_the_model_instead_of_retrying(monkeypatch):
+    monkeypatch.setattr(upstreamScheduler, "RATE_LIMIT_PAUSE", 0.3)
+    scheduler = make_scheduler()
+    attempts = []
+
+    def rate_limited():
+        attempts.append(1)
+        raise RateLimited()
+
+    with pytest.raises(RateLimited):
+        scheduler.call(MODEL, rate_limited)
+    assert len(attempts) == 1
+
+    started = time.monotonic()
+    assert scheduler.call(MODEL, lambda: "ok") == "ok"
+    assert time.monotonic() - started >= 0.25
+
+
+def test_shedding_accounts_for_a_rate_limit_pause(monkeypatch):
+    monkeypatch.setattr(upstreamScheduler, "RATE_LIMIT_PAUSE", 5.0)
+    scheduler = make_scheduler()
+
+    def rate_limited():
+        raise RateLimited()
+
+    with pytest.raises(RateLimited):
+        scheduler.call(MODEL, rate_limited)
+    with pytest.raises(UpstreamOverloaded):
+        scheduler.call(MODEL, lambda: None, deadline=1)
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    scheduler = make_scheduler()
+    blocker = Blocker(scheduler)
+
+    async def scenario():
+        waiter = asyncio.ensure_future(scheduler.acall(MODEL, lambda: None, deadline=None))
+        await asyncio.to_thread(wait_until, lambda: len(scheduler._queue(MODEL).waiting) == 1)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(scenario())
+    assert scheduler._queue(MODEL).waiting == []
+    blocker.finish()
+    assert scheduler._queue(MODEL).running == 0
+
+
+def test_queued_async_calls_do_not_hold_threadpool_threads():
+    scheduler = make_scheduler()
+    blocker = Blocker(scheduler)
+
+    async def scenario():
+        anyio.to_thread.current_default_thread_limiter().total_tokens = 2
+        queued = [asyncio.ensure_future(scheduler.acall(MODEL, lambda: "upstream", deadline=None))
+                  for _ in range(10)]
+        await asyncio.to_thread(wait_until, lambda: len(scheduler._queue(MODEL).waiting) == 10)
+
+        # Other threadpool work (Chroma, the food search) still gets a thread
+        assert await asyncio.wait_for(anyio.to_thread.run_sync(lambda: "db"), timeout=1) == "db"
+
+        blocker.finish()
+        assert await asyncio.gather(*queued) == ["upstream"] * 10
+
+    asyncio.run(scenario())
+    assert scheduler._queue(MODEL).running == 0
+
+
+def test_server_workers_and_bulk_scripts_stay_within_the_quota(monkeypatch):
+    monkeypatch.setattr(upstreamScheduler, "UPSTREAM_BULK_SHARE", 0.2)
+    monkeypatch.setenv("UPSTREAM_LIMITS", '{"gemini-test": {"rps": 10, "burst": 20, "concurrency": 40}}')
+
+    monkeypatch.setenv("UPSTREAM_WORKERS", "4")
+    monkeypatch.delenv("UPSTREAM_ROLE", raising=False)
+    worker = upstreamScheduler._load_limits()[MODEL]
+    monkeypatch.setenv("UPSTREAM_ROLE", "bulk")
+    bulk = upstreamScheduler._load_limits()[MODEL]
+
+    assert worker["rps"] == pytest.approx(2.0)
+    assert bulk["rps"] == pytest.approx(2.0)
+    assert 4 * worker["rps"] + bulk["rps"] == pytest.approx(10)
+    assert 4 * worker["concurrency"] + bulk["concurrency"] <= 40
+
+
+def test_a_process_without_a_share_refuses_to_start(monkeypatch):
+    monkeypatch.setattr(upstreamScheduler, "UPSTREAM_BULK_SHARE", 0)
+    monkeypatch.setenv("UPSTREAM_ROLE", "bulk")
+    with pytest.raises(ValueError):
+        upstreamScheduler._load_limits()
@@ -0,0 +1,197 @@
+"""
+Request-scoped tracing and Prometheus-format metrics.
+
+main.py starts a trace for every request and returns its id in the
+`X-Trace-Id` header. Only a sampled fraction of traces (TRACE_SAMPLE_RATE)
+time individual pipeline stages with `with stage("embed_query"):`; sampled
+responses also carry a `Server-Timing` header. Request latency, token counts
+and cache hits/misses are recorded for every request. Metrics are kept per
+process, so every series carries a `worker` label (the process id); under
+serve.py each scrape reports only the worker that answered it, and series
+from different workers are summed in the query, e.g.
+`sum without (worker) (rate(petoai_request_seconds_count[5m]))`.
+"""
+import os
+import re
+import time
+import uuid
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+
+# Upstream calls take from tens of milliseconds to tens of seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Client-supplied trace ids are only reused when they look like ids; anything else gets a fresh one
+TRACE_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    # Tells apart the series of serve.py workers, which all scrape as the same target
+    pairs = [f'worker="{os.getpid()}"']
+    pairs.extend(f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> (per-bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                inf_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{inf_labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+METRICS: List = []
+
+request_seconds = Histogram("petoai_request_seconds", "End-to-end request latency", ["route", "status"])
+stage_seconds = Histogram("petoai_stage_seconds", "Latency of individual pipeline stages (sampled)", ["stage"])
+tokens_total = Counter("petoai_llm_tokens_total", "Prompt and response tokens reported by Gemini", ["model", "kind"])
+cache_requests_total = Counter("petoai_cache_requests_total", "Cache lookups by outcome", ["cache", "result"])
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    def __init__(self, trace_id: Optional[str] = None, sampled: Optional[bool] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.sampled = random.random() < TRACE_SAMPLE_RATE if sampled is None else sampled
+        self.stages: List[Tuple[str, float]] = []
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("petoai_trace", default=None)
+
+
+def start_trace(trace_id: Optional[str] = None) -> Trace:
+    if trace_id is not None and not TRACE_ID_PATTERN.fullmatch(trace_id):
+        trace_id = None
+    trace = Trace(trace_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage when the current request is sampled; a no-op otherwise."""
+    trace = _current_trace.get()
+    if trace is None or not trace.sampled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        trace.stages.append((name, elapsed))
+        stage_seconds.observe(elapsed, stage=name)
+
+
+def record_tokens(model: str, prompt_tokens: Optional[int], response_tokens: Optional[int]) -> None:
+    if prompt_tokens:
+        tokens_total.inc(prompt_tokens, model=model, kind="prompt")
+    if response_tokens:
+        tokens_total.inc(response_tokens, model=model, kind="response")
+
+
+def record_usage(model: str, response) -> None:
+    """Record token counts from a google.generativeai response, if it reports them."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        record_tokens(model, getattr(usage, "prompt_token_count", None),
+                      getattr(usage, "candidates_token_count", None))
+
+
+def record_cache(cache: str, hit: bool, count: int = 1) -> None:
+    if count:
+        cache_requests_total.inc(count, cache=cache, result="hit" if hit else "miss")
+
+
+def log_trace(trace: Trace, route: str, seconds: float) -> None:
+    if trace.sampled:
+        logging.info(f"trace={trace.trace_id} route={route} total_ms={seconds * 1000:.1f} "
+                     f"stages={trace.server_timing() or '-'}")
@@ -0,0 +1,426 @@
+"""
+Central scheduler for every Gemini and embedding call.
+
+    result = await scheduler.acall("gemini-1.5-flash", model.generate_content, prompt,
+                                   priority=Priority.INTERACTIVE, deadline=30)
+
+Each model has a token bucket (requests/second and burst) and a cap on
+concurrent calls. All Gemini models can additionally share a project-wide
+bucket (GEMINI_SHARED_RPS) since they draw on the same quota. Waiting calls
+are served by priority class, then earliest deadline, then arrival order.
+A call whose deadline will pass before it could start is shed with
+UpstreamOverloaded instead of being queued. When an upstream answers 429
+the model's bucket is drained and paused briefly rather than retried, so
+bursts don't turn into retry storms.
+
+The API modules use `await scheduler.acall(...)`: queued calls wait on the
+event loop and only take a threadpool thread once admitted, so a backlog of
+one class can't starve the pool that other classes (and the Chroma and food
+lookups) need. Scripts such as ingestall.py use the blocking `call()`.
+
+Limits and priorities are per process, so the quota is divided between
+processes up front. Scripts such as ingestall.py run with
+UPSTREAM_ROLE=bulk and take UPSTREAM_BULK_SHARE of every limit; the server
+takes the rest, split evenly across the UPSTREAM_WORKERS that serve.py
+sets. The two together never exceed the configured quota, but BULK work in
+a script does not queue behind server traffic.
+"""
+import os
+import json
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from enum import IntEnum
+from typing import Any, Callable, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from tracing import Counter, Gauge, Histogram, stage
+
+DEFAULT_LIMITS = {
+    # rps: sustained requests/second, burst: bucket size, concurrency: max calls in flight
+    "gemini-1.5-flash": {"rps": 4.0, "burst": 8, "concurrency": 16},
+    "gemini-1.5-pro-latest": {"rps": 1.0, "burst": 2, "concurrency": 4},
+    "embedding-001": {"rps": 25.0, "burst": 50, "concurrency": 32},
+}
+GEMINI_SHARED_RPS = float(os.getenv("GEMINI_SHARED_RPS", "0"))  # 0 disables the shared bucket
+RATE_LIMIT_PAUSE = float(os.getenv("UPSTREAM_RATE_LIMIT_PAUSE", "2.0"))
+DEFAULT_DEADLINE = float(os.getenv("UPSTREAM_DEFAULT_DEADLINE", "60"))
+# Fraction of every limit reserved for bulk scripts (UPSTREAM_ROLE=bulk); the server gets the rest
+UPSTREAM_BULK_SHARE = float(os.getenv("UPSTREAM_BULK_SHARE", "0.2"))
+
+queue_depth = Gauge("petoai_upstream_queue_depth", "Calls waiting for an upstream slot", ["model"])
+in_flight = Gauge("petoai_upstream_in_flight", "Upstream calls currently running", ["model"])
+wait_seconds = Histogram("petoai_upstream_wait_seconds", "Time spent queued before an upstream call",
+                         ["model", "priority"])
+shed_total = Counter("petoai_upstream_shed_total", "Calls rejected because they would miss their deadline",
+                     ["model", "priority"])
+rate_limited_total = Counter("petoai_upstream_rate_limited_total", "Upstream 429 responses", ["model"])
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # chat and vision requests a user is waiting on
+    STANDARD = 1     # longer user-facing work such as diet plans
+    BULK = 2         # ingest and other offline jobs
+
+
+class UpstreamOverloaded(Exception):
+    """Raised when a call is shed because it cannot start before its deadline."""
+
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(f"Upstream {model} is overloaded; retry in {retry_after:.0f}s")
+        self.model = model
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until_token(self, now: float) -> float:
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float, now: float) -> None:
+        self.tokens = 0.0
+        self.updated = now
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+class _Waiter:
+    """A queued call; the scheduler grants it a slot and wakes it, from any thread."""
+
+    def __init__(self, priority: Priority, deadline: Optional[float], seq: int,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.deadline = deadline
+        self.entry = (int(priority), deadline if deadline is not None else float("inf"), seq)
+        self.granted = False
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+    def rearm(self) -> None:
+        if self.loop is None:
+            self.event.clear()
+        elif self.future.done():
+            self.future = self.loop.create_future()
+
+
+class _ModelQueue:
+    def __init__(self, model: str, rps: float, burst: float, concurrency: int):
+        self.model = model
+        self.bucket = TokenBucket(rps, burst)
+        self.concurrency = max(int(concurrency), 1)
+        self.running = 0
+        self.waiting = []  # heap of (priority, deadline, seq, waiter)
+        # Moving average of call duration, used to predict queueing delay
+        self.avg_service = 1.0
+
+    def expected_wait(self, position: int, now: float) -> float:
+        token_wait = self.bucket.time_until_token(now) + position / self.bucket.rate
+        slot_wait = (max(self.running + position + 1 - self.concurrency, 0) / self.concurrency) * self.avg_service
+        return max(token_wait, slot_wait)
+
+    def remove(self, waiter: _Waiter) -> None:
+        self.waiting = [item for item in self.waiting if item[3] is not waiter]
+        heapq.heapify(self.waiting)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """True for 429s from the genai SDK (ResourceExhausted) or the REST calls made with `requests`."""
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+def quota_share() -> float:
+    """Fraction of the upstream quota this process may use."""
+    bulk_share = min(max(UPSTREAM_BULK_SHARE, 0.0), 1.0)
+    if os.getenv("UPSTREAM_ROLE", "server") == "bulk":
+        return bulk_share
+    # Under serve.py every worker gets an equal share of the server's part
+    workers = max(int(os.getenv("UPSTREAM_WORKERS", "1")), 1)
+    return (1.0 - bulk_share) / workers
+
+
+def _load_limits() -> Dict[str, Dict[str, float]]:
+    limits = {model: dict(values) for model, values in DEFAULT_LIMITS.items()}
+    for model, values in json.loads(os.getenv("UPSTREAM_LIMITS", "{}")).items():
+        limits.setdefault(model, {"rps": 1.0, "burst": 1, "concurrency": 1}).update(values)
+    share = quota_share()
+    if share <= 0:
+        raise ValueError(f"UPSTREAM_BULK_SHARE={UPSTREAM_BULK_SHARE} leaves this process no upstream quota")
+    for values in limits.values():
+        values["rps"] *= share
+        values["burst"] = max(values["burst"] * share, 1)
+        values["concurrency"] = max(int(values["concurrency"] * share), 1)
+    return limits
+
+
+class UpstreamScheduler:
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None, shared_rps: float = GEMINI_SHARED_RPS):
+        # Held only for bookkeeping, never while waiting, so the event loop may take it too
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._queues: Dict[str, _ModelQueue] = {
+            model: _ModelQueue(model, v["rps"], v["burst"], v["concurrency"])
+            for model, v in (limits or _load_limits()).items()
+        }
+        shared_rps *= quota_share()
+        self.shared = TokenBucket(shared_rps, max(shared_rps, 1)) if shared_rps else None
+
+    def total_concurrency(self) -> int:
+        """Upper bound on upstream calls running at once, e.g. for sizing the threadpool."""
+        return sum(queue.concurrency for queue in self._queues.values())
+
+    def limits(self) -> Dict[str, Dict[str, float]]:
+        """The limits this process actually applies, after its share of the quota is taken."""
+        limits = {model: {"rps": queue.bucket.rate, "burst": queue.bucket.capacity, "concurrency": queue.concurrency}
+                  for model, queue in self._queues.items()}
+        if self.shared:
+            limits["gemini-shared"] = {"rps": self.shared.rate, "burst": self.shared.capacity}
+        return limits
+
+    def _queue(self, model: str) -> _ModelQueue:
+        if model not in self._queues:
+            raise KeyError(f"No upstream limits configured for model '{model}'")
+        return self._queues[model]
+
+    def _buckets(self, queue: _ModelQueue):
+        if self.shared and queue.model.startswith("gemini"):
+            return [queue.bucket, self.shared]
+        return [queue.bucket]
+
+    def _dispatch(self, queue: _ModelQueue, now: float) -> Optional[float]:
+        """Grant slots to the head of the queue while capacity allows (lock held).
+
+        Returns how long until the head could get a token, or None when nothing
+        is waiting on the clock (the queue is empty or every slot is busy).
+        """
+        granted = False
+        while queue.waiting and queue.running < queue.concurrency:
+            token_wait = max(b.time_until_token(now) for b in self._buckets(queue))
+            if token_wait > 0:
+                if granted:
+                    # The caller's timer may belong to a waiter that just left; let the new head set its own
+                    queue.waiting[0][3].wake()
+                return token_wait
+            for bucket in self._buckets(queue):
+                bucket.take()
+            waiter = heapq.heappop(queue.waiting)[3]
+            queue.running += 1
+            waiter.granted = True
+            waiter.wake()
+            granted = True
+        return None
+
+    def _enqueue(self, queue: _ModelQueue, waiter: _Waiter) -> Optional[float]:
+        """Shed the call if it can't start in time, else queue it and dispatch (lock held)."""
+        now = time.monotonic()
+        position = sum(1 for item in queue.waiting if item[:3] < waiter.entry)
+        expected = queue.expected_wait(position, now)
+        if waiter.deadline is not None and now + expected > waiter.deadline:
+            shed_total.inc(model=queue.model, priority=waiter.priority.name)
+            raise UpstreamOverloaded(queue.model, expected)
+        heapq.heappush(queue.waiting, waiter.entry + (waiter,))
+        wait = self._dispatch(queue, now)
+        self._update_gauges(queue)
+        return wait
+
+    def _recheck(self, queue: _ModelQueue, waiter: _Waiter) -> Optional[float]:
+        """After a wake-up or timeout: shed past the deadline, else dispatch again (lock held)."""
+        now = time.monotonic()
+        if waiter.deadline is not None and now >= waiter.deadline:
+            queue.remove(waiter)
+            self._update_gauges(queue)
+            shed_total.inc(model=queue.model, priority=waiter.priority.name)
+            raise UpstreamOverloaded(queue.model, queue.avg_service)
+        wait = self._dispatch(queue, now)
+        self._update_gauges(queue)
+        return wait
+
+    def _abandon(self, queue: _ModelQueue, waiter: _Waiter) -> None:
+        """The waiter went away (cancelled or interrupted); give back its place or its slot (lock held)."""
+        if waiter.granted:
+            self._give_back(queue)
+        else:
+            queue.remove(waiter)
+            self._update_gauges(queue)
+
+    def _give_back(self, queue: _ModelQueue) -> None:
+        """Return a granted slot that was never used (lock held)."""
+        queue.running -= 1
+        self._dispatch(queue, time.monotonic())
+        self._update_gauges(queue)
+        if queue.waiting:
+            queue.waiting[0][3].wake()
+
+    @staticmethod
+    def _timeout(waiter: _Waiter, token_wait: Optional[float]) -> Optional[float]:
+        if waiter.deadline is None:
+            return token_wait
+        until_deadline = max(waiter.deadline - time.monotonic(), 0.0)
+        return until_deadline if token_wait is None else min(token_wait, until_deadline)
+
+    def _update_gauges(self, queue: _ModelQueue) -> None:
+        queue_depth.set(len(queue.waiting), model=queue.model)
+        in_flight.set(queue.running, model=queue.model)
+
+    def _acquire(self, queue: _ModelQueue, priority: Priority, deadline: Optional[float]) -> None:
+        waiter = _Waiter(priority, deadline, next(self._seq))
+        with self._lock:
+            wait = self._enqueue(queue, waiter)
+        try:
+            while not waiter.granted:
+                waiter.event.wait(self._timeout(waiter, wait))
+                with self._lock:
+                    if waiter.granted:
+                        break
+                    waiter.rearm()
+                    wait = self._recheck(queue, waiter)
+        except UpstreamOverloaded:
+            raise
+        except BaseException:
+            with self._lock:
+                self._abandon(queue, waiter)
+            raise
+
+    async def _acquire_async(self, queue: _ModelQueue, priority: Priority, deadline: Optional[float]) -> None:
+        waiter = _Waiter(priority, deadline, next(self._seq), loop=asyncio.get_running_loop())
+        with self._lock:
+            wait = self._enqueue(queue, waiter)
+        try:
+            while not waiter.granted:
+                await asyncio.wait([waiter.future], timeout=self._timeout(waiter, wait))
+                with self._lock:
+                    if waiter.granted:
+                        break
+                    waiter.rearm()
+                    wait = self._recheck(queue, waiter)
+        except UpstreamOverloaded:
+            raise
+        except BaseException:
+            with self._lock:
+                self._abandon(queue, waiter)
+            raise
+
+    def _release(self, queue: _ModelQueue, seconds: float, rate_limited: bool) -> None:
+        with self._lock:
+            queue.running -= 1
+            queue.avg_service = 0.8 * queue.avg_service + 0.2 * seconds
+            now = time.monotonic()
+            if rate_limited:
+                for bucket in self._buckets(queue):
+                    bucket.pause(RATE_LIMIT_PAUSE, now)
+            self._dispatch(queue, now)
+            self._update_gauges(queue)
+            # Waiters on the clock re-check on their own; wake the head so it sees the new pause or slot
+            if queue.waiting:
+                queue.waiting[0][3].wake()
+
+    def _run(self, queue: _ModelQueue, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        rate_limited = False
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            rate_limited = is_rate_limited(e)
+            if rate_limited:
+                rate_limited_total.inc(model=queue.model)
+            raise
+        finally:
+            self._release(queue, time.perf_counter() - started, rate_limited)
+
+    def call(self, model: str, fn: Callable[..., Any], *args: Any,
+             priority: Priority = Priority.INTERACTIVE, deadline: Optional[float] = DEFAULT_DEADLINE,
+             **kwargs: Any) -> Any:
+        """Run fn(*args, **kwargs) once `model` has capacity, blocking this thread while queued.
+
+        `deadline` is seconds from now (None waits forever).
+        """
+        queue = self._queue(model)
+        absolute_deadline = time.monotonic() + deadline if deadline is not None else None
+
+        queued = time.perf_counter()
+        with stage(f"queue_{model}"):
+            self._acquire(queue, priority, absolute_deadline)
+        wait_seconds.observe(time.perf_counter() - queued, model=model, priority=priority.name)
+        return self._run(queue, fn, *args, **kwargs)
+
+    async def acall(self, model: str, fn: Callable[..., Any], *args: Any,
+                    priority: Priority = Priority.INTERACTIVE, deadline: Optional[float] = DEFAULT_DEADLINE,
+                    **kwargs: Any) -> Any:
+        """Like call(), but queue on the event loop and run the blocking fn in the threadpool once admitted."""
+        queue = self._queue(model)
+        absolute_deadline = time.monotonic() + deadline if deadline is not None else None
+
+        queued = time.perf_counter()
+        with stage(f"queue_{model}"):
+            await self._acquire_async(queue, priority, absolute_deadline)
+        wait_seconds.observe(time.perf_counter() - queued, model=model, priority=priority.name)
+
+        started = False
+
+        def run():
+            nonlocal started
+            started = True
+            return self._run(queue, fn, *args, **kwargs)
+
+        try:
+            return await run_in_threadpool(run)
+        except BaseException:
+            # Cancelled while waiting for a thread: fn never ran, so hand the slot back.
+            # Once fn has started, the thread finishes it and releases the slot itself.
+            if not started:
+                with self._lock:
+                    self._give_back(queue)
+            raise
+
+
+class ScheduledEmbeddings:
+    """Wraps a LangChain embeddings object so every call goes through the scheduler."""
+
+    def __init__(self, embeddings, priority: Priority = Priority.BULK, deadline: Optional[float] = None,
+                 model: str = "embedding-001"):
+        self.embeddings = embeddings
+        self.priority = priority
+        self.deadline = deadline
+        self.model = model
+
+    def embed_query(self, text: str):
+        return scheduler.call(self.model, self.embeddings.embed_query, text,
+                              priority=self.priority, deadline=self.deadline)
+
+    def embed_documents(self, texts):
+        return scheduler.call(self.model, self.embeddings.embed_documents, texts,
+                              priority=self.priority, deadline=self.deadline)
+
+
+scheduler = UpstreamScheduler()